@@ -0,0 +1,101 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from flask import current_app
+from config import Config
+from achievements import evaluate_achievements
+from logger import log_info, log_error, log_debug
+
+# Очереди событий "тест отправлен": достижения считаются вне обработки HTTP-запроса.
+# События одного пользователя всегда попадают в одну очередь и обрабатываются по порядку.
+_queues = []
+_workers_lock = threading.Lock()
+_pending = 0
+_pending_cond = threading.Condition()
+_stats = {"processed": 0, "retried": 0, "failed": 0}
+
+
+def enqueue_test_submitted(event):
+    global _pending
+    _ensure_workers()
+    with _pending_cond:
+        _pending += 1
+    _queues[event["user_id"] % len(_queues)].put((current_app._get_current_object(), event))
+    log_debug("Queued achievement evaluation for user %s, test %s", event['user_id'], event['test_id'])
+
+
+def _ensure_workers():
+    if _queues:
+        return
+    with _workers_lock:
+        if _queues:
+            return
+        for i in range(Config.ACHIEVEMENT_WORKERS):
+            worker_queue = queue.Queue()
+            threading.Thread(target=_worker_loop, args=(worker_queue,), name=f"achievement-worker-{i}", daemon=True).start()
+            _queues.append(worker_queue)
+        log_info(f"Started {len(_queues)} achievement workers")
+
+
+def _worker_loop(worker_queue):
+    global _pending
+    while True:
+        app, event = worker_queue.get()
+        try:
+            _process_event(app, event)
+        finally:
+            with _pending_cond:
+                _pending -= 1
+                _pending_cond.notify_all()
+
+
+def _process_event(app, event):
+    user_id = event["user_id"]
+    for attempt in range(1, Config.ACHIEVEMENT_JOB_MAX_ATTEMPTS + 1):
+        try:
+            with app.app_context():
+                evaluate_achievements(event)
+            _stats["processed"] += 1
+            return
+        except Exception as e:
+            log_error(f"Achievement evaluation attempt {attempt} failed for user {user_id}: {str(e)}")
+            if attempt < Config.ACHIEVEMENT_JOB_MAX_ATTEMPTS:
+                _stats["retried"] += 1
+                time.sleep(Config.ACHIEVEMENT_JOB_RETRY_DELAY * 2 ** (attempt - 1))
+    _stats["failed"] += 1
+    log_error(f"Dropping achievement evaluation for user {user_id}, test {event['test_id']} after "
+              f"{Config.ACHIEVEMENT_JOB_MAX_ATTEMPTS} attempts")
+
+
+def drain(timeout=None):
+    """Ждёт обработки всех событий в очереди. Возвращает False, если истёк timeout."""
+    with _pending_cond:
+        drained = _pending_cond.wait_for(lambda: _pending == 0, timeout)
+    if not drained:
+        log_error(f"Achievement queue not drained within {timeout}s, {_pending} events pending")
+    return drained
+
+
+def queue_stats():
+    return dict(_stats, pending=_pending, workers=len(_queues))
+
+
+# Потоки воркеров не переживают fork: дочерний процесс запустит свои при первом событии
+def _reset_after_fork():
+    global _pending, _pending_cond, _workers_lock
+    _queues.clear()
+    _pending = 0
+    _pending_cond = threading.Condition()
+    _workers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@atexit.register
+def _drain_on_exit():
+    if _pending:
+        log_info(f"Draining {_pending} pending achievement events before exit")
+        drain(Config.ACHIEVEMENT_QUEUE_DRAIN_TIMEOUT)
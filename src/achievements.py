@@ -1,6 +1,8 @@
-from models import db, User, Topic, Test, UsersFormulas, Modul, Achievement
-from datetime import datetime, timedelta
-from logger import log_info, log_error, log_debug
+import json
+from models import db, Achievement
+from user_stats import get_user_stats
+from profile_cache import bump_profile_version
+from logger import log_info, log_sampled, log_error, log_debug
 
 ACHIEVEMENTS = {
     "Начинающий физик": {
@@ -53,105 +55,74 @@ ACHIEVEMENTS = {
     }
 }
 
-def check_achievements(user_id):
-    log_info(f"Checking achievements for user {user_id}")
-    try:
-        user = User.query.get(user_id)
-        if not user:
-            return
-
-        # "Начинающий физик": первая тема и 5 формул
-        if Topic.query.filter_by(user_id=user_id).count() >= 1 and UsersFormulas.query.filter_by(iduser=user_id).count() >= 5:
-            add_achievement(user_id, "Начинающий физик")
-            log_info(f"User {user_id} qualifies for 'Начинающий физик' (Topics: {topics_count}, Formulas: {formulas_count})")
-
-        # "Скоростной решатель": тест меньше чем за минуту
-        last_test = Test.query.filter_by(user_id=user_id).order_by(Test.end_time.desc()).first()
-        if last_test and (last_test.end_time - last_test.start_time).total_seconds() < 60:
-            add_achievement(user_id, "Скоростной решатель")
-            log_info(f"User {user_id} qualifies for 'Скоростной решатель' (Test time: {(last_test.end_time - last_test.start_time).total_seconds()} seconds)")
-
-        # "Физик-перфекционист": тест на 100% с первой попытки
-        if last_test and last_test.success_rate == 100 and Test.query.filter_by(user_id=user_id, section=last_test.section).count() == 1:
-            add_achievement(user_id, "Физик-перфекционист")
-            log_info(f"User {user_id} qualifies for 'Физик-перфекционист' (Section: {last_test.section})")
-
-        # "Мастер Энергии": все темы по энергетике на 80%+
-        energy_module = Modul.query.filter_by(name="Энергетика").first()
-        if energy_module:
-            energy_topics = Topic.query.filter_by(user_id=user_id, name=energy_module.name).all()
-            if energy_topics and all(topic.success_rate >= 80 for topic in energy_topics):
-                add_achievement(user_id, "Мастер Энергии")
-                log_info(f"User {user_id} qualifies for 'Мастер Энергии' (Energy topics count: {len(energy_topics)})")
-
-        # "Кинематический гений": тест по кинематике на 100%
-        kinematics_test = Test.query.filter_by(user_id=user_id, section="Кинематика", success_rate=100).first()
-        if kinematics_test:
-            add_achievement(user_id, "Кинематический гений")
-            log_info(f"User {user_id} qualifies for 'Кинематический гений'")
-
-        # "Динамический мастер": тест по динамике на 100%
-        dynamics_test = Test.query.filter_by(user_id=user_id, section="Динамика", success_rate=100).first()
-        if dynamics_test:
-            add_achievement(user_id, "Динамический мастер")
-            log_info(f"User {user_id} qualifies for 'Динамический мастер'")
+# Правила достижений: (название, условие(статистика, событие)).
+# Условие вычисляется по сводной статистике пользователя (user_stats) и событию отправки теста
+# без обращения к истории тестов.
+SECTION_PERFECT_ACHIEVEMENTS = {
+    "Кинематика": "Кинематический гений",
+    "Динамика": "Динамический мастер",
+    "Статика": "Статистический эксперт",
+    "Энергетика": "Энергетический виртуоз",
+    "Термофизика": "Термофизический специалист"
+}
 
-        # "Статистический эксперт": тест по статике на 100%
-        statics_test = Test.query.filter_by(user_id=user_id, section="Статика", success_rate=100).first()
-        if statics_test:
-            add_achievement(user_id, "Статистический эксперт")
-            log_info(f"User {user_id} qualifies for 'Статистический эксперт'")
+ACHIEVEMENT_RULES = [
+    # После отправки теста у пользователя всегда есть хотя бы одна тема
+    ("Начинающий физик", lambda stats, event: stats.formulas_mastered >= 5),
+    ("Скоростной решатель", lambda stats, event: event["duration"] < 60),
+    ("Физик-перфекционист", lambda stats, event: event["success_rate"] == 100 and event["section_attempts"] == 1),
+    ("Мастер Энергии", lambda stats, event: event["section"] == "Энергетика" and event["topic_success_rate"] >= 80),
+] + [
+    (name, lambda stats, event, section=section: section in json.loads(stats.sections_perfected))
+    for section, name in SECTION_PERFECT_ACHIEVEMENTS.items()
+] + [
+    ("Формульный коллекционер", lambda stats, event: stats.formulas_mastered >= 20),
+    ("Тестовый марафонец", lambda stats, event: stats.tests_on_last_day >= 10),
+    ("Недельный стрик", lambda stats, event: stats.current_streak >= 7),
+]
 
-        # "Энергетический виртуоз": тест по энергетике на 100%
-        energy_test = Test.query.filter_by(user_id=user_id, section="Энергетика", success_rate=100).first()
-        if energy_test:
-            add_achievement(user_id, "Энергетический виртуоз")
-            log_info(f"User {user_id} qualifies for 'Энергетический виртуоз'")
+def test_submitted_event(test, topic):
+    return {
+        "user_id": test.user_id,
+        "test_id": test.id,
+        "section": test.section,
+        "success_rate": test.success_rate,
+        "duration": (test.end_time - test.start_time).total_seconds(),
+        "date": test.date.isoformat(),
+        "section_attempts": topic.tests_passed,
+        "topic_success_rate": topic.success_rate
+    }
 
-        # "Термофизический специалист": тест по термофизике на 100%
-        thermo_test = Test.query.filter_by(user_id=user_id, section="Термофизика", success_rate=100).first()
-        if thermo_test:
-            add_achievement(user_id, "Термофизический специалист")
-            log_info(f"User {user_id} qualifies for 'Термофизический специалист'")
+# Достижения проверяются в точке сохранения (SAVEPOINT) внутри транзакции отправки теста:
+# ошибка в правилах не отменяет сохранение самого теста
+def check_achievements(event):
+    try:
+        with db.session.begin_nested():
+            award_achievements(event)
+    except Exception as e:
+        log_error(f"Error checking achievements for user {event['user_id']}: {str(e)}")
 
-        # "Формульный коллекционер": освоено 20 формул
-        if UsersFormulas.query.filter_by(iduser=user_id).count() >= 20:
-            add_achievement(user_id, "Формульный коллекционер")
-            log_info(f"User {user_id} qualifies for 'Формульный коллекционер' (Formulas: {formulas_count})")
+def evaluate_achievements(event):
+    award_achievements(event)
+    db.session.commit()
 
-        # "Тестовый марафонец": 10 тестов за день
-        today = datetime.now().date()
-        tests_today = Test.query.filter_by(user_id=user_id).filter(Test.date == today).count()
-        if tests_today >= 10:
-            add_achievement(user_id, "Тестовый марафонец")
-            log_info(f"User {user_id} qualifies for 'Тестовый марафонец' (Tests today: {tests_today})")
+def award_achievements(event):
+    user_id = event["user_id"]
+    log_sampled("Checking achievements for user %s after test %s", user_id, event['test_id'])
 
-        # "Недельный стрик": тесты каждый день в течение недели
-        week_ago = datetime.now().date() - timedelta(days=6)
-        daily_tests = db.session.query(db.func.distinct(db.func.date(Test.date))).filter(
-            Test.user_id == user_id,
-            Test.date >= week_ago
-        ).count()
-        if daily_tests >= 7:
-            add_achievement(user_id, "Недельный стрик")
-            log_info(f"User {user_id} qualifies for 'Недельный стрик' (Daily tests: {daily_tests})")
-    except Exception as e:
-        log_error(f"Error checking achievements for user {user_id}: {str(e)}")
+    stats = get_user_stats(user_id)
+    earned = {name for (name,) in db.session.query(Achievement.achievement_name).filter_by(user_id=user_id)}
+    new_names = [name for name, rule in ACHIEVEMENT_RULES if name not in earned and rule(stats, event)]
+    if new_names:
+        db.session.add_all([new_achievement(user_id, name) for name in new_names])
+        bump_profile_version(user_id)
+        log_info(f"User {user_id} earned achievements: {', '.join(new_names)}")
+    return new_names
 
-def add_achievement(user_id, achievement_name):
-    try:
-        if not Achievement.query.filter_by(user_id=user_id, achievement_name=achievement_name).first():
-            new_achievement = Achievement(
-                user_id=user_id,
-                achievement_name=achievement_name,
-                achievement_description=ACHIEVEMENTS[achievement_name]["description"],
-                image_path=ACHIEVEMENTS[achievement_name]["image_path"]
-            )
-            db.session.add(new_achievement)
-            db.session.commit()
-            log_info(f"Achievement '{achievement_name}' added for user {user_id}")
-        else:
-            log_debug(f"Achievement '{achievement_name}' already exists for user {user_id}")
-    except Exception as e:
-        db.session.rollback()
-        log_error(f"Failed to add achievement '{achievement_name}' for user {user_id}: {str(e)}")
\ No newline at end of file
+def new_achievement(user_id, achievement_name):
+    return Achievement(
+        user_id=user_id,
+        achievement_name=achievement_name,
+        achievement_description=ACHIEVEMENTS[achievement_name]["description"],
+        image_path=ACHIEVEMENTS[achievement_name]["image_path"]
+    )
@@ -1,7 +1,10 @@
+import io
 from flask import request
 from flask_restx import Namespace, Resource, fields
 from models import db, Modul, Formula, Video
 from logger import log_info, log_error, log_debug
+from catalog_snapshot import bump_catalog_version, rebuild_catalog_snapshot
+from formula_import import IMPORT_FORMATS, parse_rows, import_formulas
 
 modul_np = Namespace('Add_moduls', description='Добавление модулей')
 formula_np = Namespace('Add_formulas', description='Добавление формул')
@@ -35,7 +38,10 @@ class AddModule(Resource):
         try:
             new_module = Modul(name=name, description=description)
             db.session.add(new_module)
+            db.session.flush()
+            bump_catalog_version([new_module.id])
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Module '{name}' added successfully")
             return new_module.to_dict(), 201
         except Exception as e:
@@ -58,7 +64,9 @@ class ModuleResource(Resource):
             module.name = data.get('name', module.name)
             module.description = data.get('description', module.description)
 
+            bump_catalog_version([module_id])
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Module with id {module_id} updated successfully")
             return module.to_dict(), 200
         except Exception as e:
@@ -75,7 +83,9 @@ class ModuleResource(Resource):
                 return {'message': 'Module not found'}, 404
 
             db.session.delete(module)
+            bump_catalog_version()
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Module with id {module_id} deleted successfully")
             return {'message': 'Module deleted successfully'}, 200
         except Exception as e:
@@ -108,7 +118,9 @@ class AddFormula(Resource):
         try:
             new_formula = Formula(name=name, description=description, formula=formula_text, idmodul=idmodul)
             db.session.add(new_formula)
+            bump_catalog_version([module.id])
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Formula '{name}' added successfully to module {idmodul}")
             return new_formula.to_dict(), 201
         except Exception as e:
@@ -116,6 +128,31 @@ class AddFormula(Resource):
             log_error(f"Failed to add formula: {str(e)}")
             return {'message': 'Database error'}, 500
 
+@formula_np.route('/import')
+class ImportFormulas(Resource):
+    @formula_np.doc('import_formulas', params={
+        'format': 'ndjson или csv; по умолчанию определяется по Content-Type (text/csv — CSV, иначе NDJSON)'
+    })
+    @formula_np.response(200, 'Import finished, per-row errors are reported in "errors"')
+    @formula_np.response(400, 'Unsupported format')
+    @formula_np.response(500, 'Database error')
+    def post(self):
+        fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        if fmt not in IMPORT_FORMATS:
+            return {'message': f"Unsupported format '{fmt}', expected one of: {', '.join(IMPORT_FORMATS)}"}, 400
+
+        # Тело запроса читается потоком, без загрузки всего файла в память
+        stream = io.TextIOWrapper(io.BufferedReader(request.stream), encoding='utf-8-sig', newline='')
+        try:
+            result = import_formulas(parse_rows(stream, fmt))
+            return result, 200
+        except UnicodeDecodeError as e:
+            log_error(f"Formula import body is not valid UTF-8: {str(e)}")
+            return {'message': 'Request body must be UTF-8 encoded'}, 400
+        except Exception as e:
+            log_error(f"Failed to import formulas: {str(e)}")
+            return {'message': 'Database error'}, 500
+
 @formula_np.route('/formulas/<int:formula_id>')
 class FormulaResource(Resource):
     @formula_np.doc('update_formula', responses={200: 'Formula updated successfully', 404: 'Formula not found', 500: 'Database error'})
@@ -128,6 +165,7 @@ class FormulaResource(Resource):
                 return {'message': 'Formula not found'}, 404
 
             data = request.json
+            old_module_id = formula.idmodul
             formula.name = data.get('name', formula.name)
             formula.description = data.get('description', formula.description)
             formula.formula = data.get('formula', formula.formula)
@@ -140,7 +178,10 @@ class FormulaResource(Resource):
                     log_error(f"Module with id {data['idmodul']} not found")
                     return {'message': f'Module with id {data["idmodul"]} does not exist'}, 404
 
+            # Формула могла переехать в другой модуль: изменились оба
+            bump_catalog_version([old_module_id, formula.idmodul])
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Formula with id {formula_id} updated successfully")
             return formula.to_dict(), 200
         except Exception as e:
@@ -157,7 +198,9 @@ class FormulaResource(Resource):
                 return {'message': 'Formula not found'}, 404
 
             db.session.delete(formula)
+            bump_catalog_version([formula.idmodul])
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Formula with id {formula_id} deleted successfully")
             return {'message': 'Formula deleted successfully'}, 200
         except Exception as e:
@@ -1,48 +1,74 @@
+import os
 from flask import Flask
 from flask_restx import Api
 from config import Config
 from models import db
+from database import init_database
 from module import module_ns
 from admin_routes import modul_np, formula_np
 from quiz import quiz_ns
 from user import user_ns
 from video import video_ns
+from user_stats import rebuild_user_stats_command
+from query_plans import check_query_plans_command
+from formula_import import import_formulas_command
+from catalog_snapshot import rebuild_catalog_snapshot_command
+from migration import init_db_command, migrate_database
+from metrics import init_metrics
+from query_profiler import init_query_profiler
 from flask_cors import CORS
-from logger import log_info, log_error, log_debug 
+from logger import log_info, log_error, log_debug
 
-app = Flask(__name__)
-api = Api(app)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+
+# Фабрика приложения не обращается к БД: схему создаёт и обновляет команда `flask init-db`
+def create_app(config_object=Config):
+    log_info("Starting Flask application initialization")
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    # Необязательный файл настроек поверх переменных окружения (формат — Python-модуль с переменными Config)
+    app.config.from_envvar('APP_CONFIG_FILE', silent=True)
+    api = Api(app)
+    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+    init_database(app)
+    init_metrics(app)
+    init_query_profiler(app)
+
+    api.add_namespace(module_ns)
+    api.add_namespace(modul_np)
+    api.add_namespace(formula_np)
+    api.add_namespace(quiz_ns)
+    api.add_namespace(user_ns)
+    api.add_namespace(video_ns)
+
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_user_stats_command)
+    app.cli.add_command(check_query_plans_command)
+    app.cli.add_command(import_formulas_command)
+    app.cli.add_command(rebuild_catalog_snapshot_command)
+    return app
+
+
+# Совместимость с существующими конфигурациями WSGI (app:application, app:app). Создание приложения
+# не обращается к БД; процессная настройка (fork, проверка схемы, снимок каталога) — в wsgi.py
+app = create_app()
 application = app
-app.config.from_object(Config)
-db.init_app(app)
 
-log_info("Starting Flask application initialization")
 
-with app.app_context():
-    try:
-        db.create_all()
-        log_info("Database tables created successfully")
-    except Exception as e:
-        log_error(f"Error creating database tables: {str(e)}")
-    
-    try:
-        from migration import migrate_database
-        migrate_database()
-        log_info("Database migration completed successfully")
-    except Exception as e:
-        log_error(f"Error during database migration: {str(e)}")
+def _dispose_engines_after_fork():
+    # Соединения пула, открытые в мастер-процессе, нельзя использовать в дочернем: каждый воркер открывает свои
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_engines_after_fork)
 
-api.add_namespace(module_ns)
-api.add_namespace(modul_np)
-api.add_namespace(formula_np)
-api.add_namespace(quiz_ns)
-api.add_namespace(user_ns)
-api.add_namespace(video_ns)
 
 if __name__ == '__main__':
     try:
+        with app.app_context():
+            migrate_database()
         log_info("Starting Flask development server")
         app.run(debug=True)
     except Exception as e:
-        log_error(f"Failed to start Flask server: {str(e)}")
\ No newline at end of file
+        log_error(f"Failed to start Flask server: {str(e)}")
@@ -0,0 +1,233 @@
+"""Нагрузочный бенчмарк API.
+
+Создаёт приложение на временной SQLite-базе, заполняет её данными заданного масштаба и
+прогоняет эндпоинты всех пространств имён через Flask test client из нескольких потоков.
+Результат (пропускная способность и p50/p95/p99 по каждому эндпоинту) выводится в JSON.
+
+Пример: python benchmark.py --users 200 --requests 500 --threads 8 --output bench.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+SECTIONS = ["Кинематика", "Динамика", "Статика", "Энергетика", "Термофизика"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark every API namespace against a temporary SQLite database.")
+    parser.add_argument('--users', type=int, default=100, help='Number of seeded users')
+    parser.add_argument('--formulas-per-module', type=int, default=40, help='Formulas in each of the 5 modules')
+    parser.add_argument('--tests-per-user', type=int, default=50, help='Seeded test history per user')
+    parser.add_argument('--videos', type=int, default=200, help='Number of seeded videos')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--threads', type=int, default=4, help='Concurrent client threads')
+    parser.add_argument('--endpoints', default='', help='Comma-separated subset of endpoint names to run')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for data and request mix')
+    parser.add_argument('--output', help='Write JSON report to this file instead of stdout')
+    return parser.parse_args()
+
+
+def create_app(db_path):
+    # Настройки логирования читаются при импорте logger, поэтому задаются до импорта приложения
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('LOG_DIR', os.path.join(os.path.dirname(db_path), 'logs'))
+    from config import Config
+    Config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    from app import create_app
+    from migration import migrate_database
+    app = create_app()
+    with app.app_context():
+        migrate_database()
+    return app
+
+
+def seed(app, args, rng):
+    from models import db, Modul, Formula, User, UsersFormulas, Test, Video
+    from user_stats import rebuild_user_stats
+
+    with app.app_context():
+        modules = [Modul(name=name, description=f'Раздел {name}') for name in SECTIONS]
+        db.session.add_all(modules)
+        db.session.flush()
+
+        formulas = []
+        for module in modules:
+            for i in range(args.formulas_per_module):
+                formulas.append(Formula(name=f'{module.name} формула {i}', description='Описание',
+                                        formula=f'F{i} = m{i} * a + {i}', idmodul=module.id))
+        db.session.add_all(formulas)
+
+        users = [User(login=f'benchuser{i}', password='Passw0rd', nickname=f'user{i}', status='beginner')
+                 for i in range(args.users)]
+        db.session.add_all(users)
+        db.session.flush()
+
+        now = datetime.now()
+        for user in users:
+            for formula in rng.sample(formulas, min(10, len(formulas))):
+                db.session.add(UsersFormulas(iduser=user.id, idformula=formula.id))
+            for _ in range(args.tests_per_user):
+                end_time = now - timedelta(minutes=rng.randint(1, 60 * 24 * 90))
+                section = rng.choice(SECTIONS)
+                db.session.add(Test(user_id=user.id, start_time=end_time - timedelta(seconds=rng.randint(20, 600)),
+                                    end_time=end_time, date=end_time.date(),
+                                    success_rate=rng.choice([0, 17, 33, 50, 67, 83, 100]), section=section))
+
+        db.session.add_all([Video(link=f'https://video.example/{i}', title=f'Видео {i}', description='Описание',
+                                  hashtag=f'#{rng.choice(SECTIONS)}') for i in range(args.videos)])
+        db.session.commit()
+        rebuild_user_stats()
+
+        return [user.id for user in users], [module.id for module in modules], [formula.id for formula in formulas]
+
+
+def build_scenarios(user_ids, module_ids, formula_ids):
+    from jwt_utils import create_token
+
+    tokens = {user_id: create_token(user_id, f'user{user_id}') for user_id in user_ids}
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def unique():
+        with counter_lock:
+            return next(counter)
+
+    def auth(rng):
+        return {'Authorization': 'Bearer ' + tokens[rng.choice(user_ids)]}
+
+    def quiz_submit(client, rng, kind):
+        headers = auth(rng)
+        start = '/quiz/start/%s' if kind == 'quiz' else '/quiz/start_symbol_quiz/%s'
+        response = client.get(start % rng.choice(module_ids) + '?stateless=1', headers=headers)
+        body = {'answers': [], 'quiz_token': response.get_json()['quiz_token']}
+        submit = '/quiz/submit_answers' if kind == 'quiz' else '/quiz/submit_symbol_answers'
+        return lambda: client.post(submit, json=body, headers=headers)
+
+    # Каждый сценарий: (имя, функция подготовки) -> подготовка возвращает вызов, время которого измеряется
+    return [
+        ('module.list_modules', lambda c, r: lambda: c.get('/module/api/modules')),
+        ('module.list_formulas', lambda c, r: lambda: c.get(f'/module/api/module/{r.choice(module_ids)}/formulas')),
+        ('module.assign_formula', lambda c, r: lambda: c.post('/module/api/assign_formula_to_user', json={
+            'user_id': r.choice(user_ids), 'formula_id': r.choice(formula_ids)})),
+        ('quiz.start', lambda c, r: (lambda h: lambda: c.get(f'/quiz/start/{r.choice(module_ids)}', headers=h))(auth(r))),
+        ('quiz.start_symbol', lambda c, r: (lambda h: lambda: c.get(f'/quiz/start_symbol_quiz/{r.choice(module_ids)}', headers=h))(auth(r))),
+        ('quiz.submit_answers', lambda c, r: quiz_submit(c, r, 'quiz')),
+        ('quiz.submit_symbol_answers', lambda c, r: quiz_submit(c, r, 'symbol_quiz')),
+        ('user.profile', lambda c, r: (lambda h: lambda: c.get('/user/profile', headers=h))(auth(r))),
+        ('user.login', lambda c, r: (lambda i: lambda: c.post('/user/login', json={
+            'login': f'benchuser{i - 1}', 'password': 'Passw0rd'}))(r.choice(user_ids))),
+        ('video.list', lambda c, r: lambda: c.get('/video/videos')),
+        ('video.add', lambda c, r: lambda: c.post('/video/add_video', json={
+            'link': f'https://video.example/new/{unique()}', 'title': 'Новое видео', 'hashtag': '#Кинематика'})),
+        ('admin.add_module', lambda c, r: lambda: c.post('/Add_moduls/add_module', json={
+            'name': f'Модуль {unique()}', 'description': 'bench'})),
+        ('admin.add_formula', lambda c, r: lambda: c.post('/Add_formulas/add_formula', json={
+            'name': f'Бенч формула {unique()}', 'description': 'bench', 'formula': 'E = m * c^2',
+            'idmodul': r.choice(module_ids)})),
+    ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def run_scenario(app, prepare, requests, threads, seed_value):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(worker_id, count):
+        rng = random.Random(seed_value * 1000 + worker_id)
+        client = app.test_client()
+        for _ in range(count):
+            call = prepare(client, rng)
+            started = time.perf_counter()
+            response = call()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    per_thread = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(worker, i, count) for i, count in enumerate(per_thread)]:
+            future.result()
+    wall_time = time.perf_counter() - wall_started
+
+    latencies.sort()
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_statuses": sorted(set(errors)),
+        "wall_time_s": round(wall_time, 4),
+        "throughput_rps": round(len(latencies) / wall_time, 2) if wall_time else None,
+        "mean_ms": to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "max_ms": to_ms(latencies[-1]) if latencies else None
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as tmp_dir:
+        app = create_app(os.path.join(tmp_dir, 'bench.db'))
+        seed_started = time.perf_counter()
+        user_ids, module_ids, formula_ids = seed(app, args, rng)
+        seed_time = time.perf_counter() - seed_started
+
+        selected = set(filter(None, args.endpoints.split(',')))
+        results = {}
+        for name, prepare in build_scenarios(user_ids, module_ids, formula_ids):
+            if selected and name not in selected:
+                continue
+            results[name] = run_scenario(app, prepare, args.requests, args.threads, args.seed)
+            print(f"{name}: {results[name]['throughput_rps']} rps, p99 {results[name]['p99_ms']} ms",
+                  file=sys.stderr)
+
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": sys.version.split()[0],
+            "seed_time_s": round(seed_time, 3),
+            "params": vars(args)
+        },
+        "endpoints": results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from flask import request
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением количества записей и счётчиками попаданий."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "max_entries": self.max_entries}
+
+
+def json_etag(data):
+    """Сильный ETag по содержимому JSON-ответа."""
+    body = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def not_modified(etag):
+    """True, если клиент прислал этот ETag в If-None-Match."""
+    return etag.strip('"') in request.if_none_match
@@ -0,0 +1,58 @@
+import json
+from flask import Response
+from config import Config
+from cache_utils import LRUCache, not_modified
+from catalog_snapshot import catalog_version, current_snapshot
+from logger import log_debug
+
+# Ответы каталога (модули, формулы модуля, видео) отдаются из общего снимка каталога (catalog_snapshot)
+# той же версии, что и версия каталога в таблице catalog_version, которую увеличивает каждая запись
+# в админских пространствах имён в той же транзакции. Чтение версии — один запрос по первичному ключу.
+# Если снимка нет или в нём нет ключа, данные строятся из БД и кэшируются в процессе по версии каталога.
+_cache = LRUCache(Config.CATALOG_CACHE_MAX_ENTRIES)
+
+# Каталог общий для всех пользователей, но клиент должен перепроверять его через If-None-Match
+CATALOG_CACHE_CONTROL = 'public, no-cache'
+
+
+def _catalog_etag(version):
+    return f'"catalog-{version}"'
+
+
+def _response(version, body_factory):
+    etag = _catalog_etag(version)
+    headers = {'ETag': etag, 'Cache-Control': CATALOG_CACHE_CONTROL}
+    if not_modified(etag):
+        return Response(status=304, headers=headers)
+    return Response(body_factory(), status=200, mimetype='application/json', headers=headers)
+
+
+def catalog_response(key, build):
+    """Ответ с документом каталога key: из снимка, иначе build(version) с кэшированием по версии каталога.
+
+    build получает ту же версию, что ключ кэша и ETag, и строит документ именно для неё.
+    ETag определяется версией каталога. 304 отдаётся, только если ключ существует: документ из снимка
+    или построенный build (из кэша по версии), чтобы несуществующий ключ отвечал ошибкой build, а не 304.
+    """
+    version = catalog_version()
+
+    def body():
+        cached = _cache.get((version, key))
+        if cached is None:
+            cached = json.dumps(build(version), ensure_ascii=False).encode('utf-8')
+            _cache.set((version, key), cached)
+            log_debug("Catalog cache miss for %s at version %s", key, version)
+        return cached
+
+    if Config.CATALOG_SNAPSHOT_ENABLED:
+        snapshot = current_snapshot(version)
+        if snapshot is not None and key in snapshot.keys():
+            # Если другой поток уже закрыл этот снимок после замены файла, тело строится из БД
+            return _response(version, lambda: snapshot.get(key) or body())
+
+    content = body()
+    return _response(version, lambda: content)
+
+
+def cache_stats():
+    return _cache.stats()
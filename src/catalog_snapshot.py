@@ -0,0 +1,261 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.engine import make_url
+from models import db, Modul, Formula, Video, CatalogVersion
+from logger import log_info, log_error, log_debug
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки при замене файла
+    fcntl = None
+
+# Снимок каталога (модули, формулы по модулям, видео) в одном файле, общем для всех воркеров.
+# Формат: заголовок (magic, версия каталога, длина индекса), JSON-индекс {ключ: [смещение, длина]}
+# и готовые JSON-тела ответов. Воркеры отображают файл в память (mmap) и отдают тела срезами,
+# перечитывая файл только после его атомарной замены (новый inode). Версия снимка на каждом запросе
+# сверяется с версией каталога в БД: снимок, устаревший после записи мимо rebuild_catalog_snapshot
+# (прямой SQL, generate_dataset, сбой между коммитом и перестроением, другой хост с общей БД), перестраивается.
+SNAPSHOT_MAGIC = b'CATSNAP1'
+_HEADER = struct.Struct('<8sQQ')
+
+_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+_snapshot = None
+# Версия каталога, для которой перестроить снимок не удалось: повторяем только после следующего изменения
+_failed_version = None
+
+
+class CatalogSnapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, index_length = _HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        index_start = _HEADER.size
+        self._index = json.loads(self._mm[index_start:index_start + index_length])
+        self._data_start = index_start + index_length
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+
+    def get(self, key):
+        """JSON-тело ответа для ключа или None, если ключа в снимке нет или снимок уже закрыт."""
+        location = self._index.get(key)
+        if location is None:
+            return None
+        offset, length = location
+        start = self._data_start + offset
+        try:
+            return self._mm[start:start + length]
+        except ValueError:  # отображение закрыто после замены файла
+            return None
+
+    def keys(self):
+        return self._index.keys()
+
+    def close(self):
+        self._mm.close()
+
+
+def catalog_version():
+    version = db.session.query(CatalogVersion.version).filter_by(id=1).scalar()
+    return version or 0
+
+
+# Вызывается в транзакции изменения каталога; снимок перестраивается после коммита.
+# module_ids — модули, которые изменились сами или чьи формулы изменились: им присваивается новая версия каталога
+def bump_catalog_version(module_ids=()):
+    updated = db.session.query(CatalogVersion).filter_by(id=1).update({CatalogVersion.version: CatalogVersion.version + 1})
+    if not updated:
+        db.session.add(CatalogVersion(id=1, version=1))
+        db.session.flush()
+    module_ids = {module_id for module_id in module_ids if module_id is not None}
+    if module_ids:
+        new_version = db.session.query(CatalogVersion.version).filter_by(id=1).scalar_subquery()
+        db.session.query(Modul).filter(Modul.id.in_(module_ids)).update(
+            {Modul.version: new_version}, synchronize_session=False
+        )
+
+
+def snapshot_path():
+    path = current_app.config.get('CATALOG_SNAPSHOT_PATH')
+    if path:
+        return path
+    # По умолчанию снимок лежит рядом с файлом SQLite, чтобы разные базы не делили один снимок
+    url = make_url(current_app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        database = url.database if os.path.isabs(url.database) else os.path.join(current_app.instance_path, url.database)
+        return database + '.catalog'
+    return os.path.join(current_app.instance_path, 'catalog.snapshot')
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def catalog_document(version, modules, formulas_by_module, module_ids):
+    """Документ /catalog: модули с вложенными формулами.
+
+    module_ids — id всех существующих модулей, чтобы клиент с since_version мог удалить пропавшие.
+    """
+    return {
+        'version': version,
+        'module_ids': module_ids,
+        'modules': [
+            dict(module.to_dict(), version=module.version, formulas=formulas_by_module.get(module.id, []))
+            for module in modules
+        ]
+    }
+
+
+def build_snapshot_documents(version):
+    """Все документы каталога из БД: три запроса независимо от числа модулей."""
+    modules = Modul.query.order_by(Modul.id).all()
+    formulas_by_module = {module.id: [] for module in modules}
+    for formula in Formula.query.order_by(Formula.idmodul, Formula.id):
+        formulas_by_module.setdefault(formula.idmodul, []).append(formula.to_dict())
+    documents = {
+        'modules': [module.to_dict() for module in modules],
+        'videos': [video.to_dict() for video in Video.query.order_by(Video.id)],
+        'catalog': catalog_document(version, modules, formulas_by_module, [module.id for module in modules])
+    }
+    for module_id, formulas in formulas_by_module.items():
+        documents[f'formulas/{module_id}'] = formulas
+    return documents
+
+
+def _read_version(path):
+    try:
+        with open(path, 'rb') as f:
+            magic, version, _ = _HEADER.unpack(f.read(_HEADER.size))
+        return version if magic == SNAPSHOT_MAGIC else None
+    except (OSError, struct.error):
+        return None
+
+
+def write_snapshot(version, documents, path):
+    """Атомарно записывает снимок. Не заменяет снимок более новой версии, записанный другим процессом."""
+    index, blobs, offset = {}, [], 0
+    for key, document in documents.items():
+        body = _dumps(document)
+        index[key] = [offset, len(body)]
+        blobs.append(body)
+        offset += len(body)
+    index_bytes = _dumps(index)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, version, len(index_bytes)))
+            f.write(index_bytes)
+            for body in blobs:
+                f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with open(path + '.lock', 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            current = _read_version(path)
+            if current is not None and current > version:
+                log_debug("Catalog snapshot version %s is newer than %s, keeping it", current, version)
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    log_info(f"Catalog snapshot version {version} written to {path} ({offset} bytes, {len(index)} documents)")
+    return True
+
+
+def rebuild_catalog_snapshot():
+    """Перестраивает снимок по текущему состоянию БД. Вызывается после коммита изменений каталога."""
+    path = snapshot_path()
+    try:
+        version = catalog_version()
+        write_snapshot(version, build_snapshot_documents(version), path)
+    except Exception as e:
+        log_error(f"Failed to rebuild catalog snapshot: {str(e)}")
+        # Устаревший снимок хуже отсутствующего: без файла воркеры читают каталог из БД
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def _load(path):
+    """Снимок из файла path; перечитывается только после замены файла, прежнее отображение закрывается."""
+    global _snapshot
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    file_id = (stat.st_ino, stat.st_mtime_ns)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.file_id == file_id:
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.file_id != file_id:
+            previous = _snapshot
+            try:
+                _snapshot = CatalogSnapshot(path)
+                log_debug("Loaded catalog snapshot version %s", _snapshot.version)
+            except (OSError, ValueError, struct.error) as e:
+                log_error(f"Failed to load catalog snapshot {path}: {str(e)}")
+                _snapshot = None
+            if previous is not None:
+                previous.close()
+        return _snapshot
+
+
+def current_snapshot(version):
+    """Снимок версии version (текущей версии каталога в БД) или None, если его нет и построить не удалось."""
+    global _failed_version
+    path = snapshot_path()
+    snapshot = _load(path)
+    if snapshot is not None and snapshot.version >= version:
+        # Более новый снимок значит, что версия прочитана до чужого коммита: отвечаем из БД по прочитанной версии
+        return snapshot if snapshot.version == version else None
+
+    # Снимка нет или он отстал от БД
+    with _rebuild_lock:
+        if _failed_version == version:
+            return None
+        file_version = _read_version(path)
+        if file_version is None or file_version < version:
+            log_info(f"Catalog snapshot version {file_version} is behind catalog version {version}, rebuilding")
+            if not rebuild_catalog_snapshot():
+                _failed_version = version
+                return None
+    snapshot = _load(path)
+    return snapshot if snapshot is not None and snapshot.version == version else None
+
+
+def ensure_catalog_snapshot():
+    """Перестраивает снимок, если его версия не совпадает с версией каталога в БД."""
+    version = catalog_version()
+    if _read_version(snapshot_path()) != version:
+        return rebuild_catalog_snapshot()
+    return True
+
+
+@click.command('rebuild-catalog-snapshot')
+@with_appcontext
+def rebuild_catalog_snapshot_command():
+    """Перестраивает файл снимка каталога по текущему состоянию БД."""
+    if not rebuild_catalog_snapshot():
+        raise click.ClickException("Failed to rebuild catalog snapshot, see log for details")
+    click.echo(f"Catalog snapshot written to {snapshot_path()}")
@@ -1,5 +1,43 @@
+import os
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///db_sqlite.db'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///db_sqlite.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Пул соединений (для файловой SQLite pre-ping и recycle не применяются)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    # PRAGMA, выполняемые при каждом новом соединении с SQLite
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
     SECRET_KEY = 'secret_key'
     CHIPHER_KEY = 3
+    QUIZ_STATELESS = False
+    QUIZ_TOKEN_TTL_MINUTES = 120
+    ACHIEVEMENT_QUEUE_ENABLED = False
+    ACHIEVEMENT_WORKERS = 2
+    ACHIEVEMENT_JOB_MAX_ATTEMPTS = 3
+    ACHIEVEMENT_JOB_RETRY_DELAY = 0.5
+    ACHIEVEMENT_QUEUE_DRAIN_TIMEOUT = 10
+    PROFILE_CACHE_MAX_ENTRIES = 5000
+    CATALOG_CACHE_MAX_ENTRIES = 1000
+    CATALOG_SNAPSHOT_ENABLED = os.environ.get('CATALOG_SNAPSHOT', 'true').lower() in ('1', 'true', 'yes')
+    # По умолчанию — рядом с файлом SQLite (<файл БД>.catalog) или в instance/catalog.snapshot
+    CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+    JWT_CACHE_MAX_ENTRIES = 10000
+    LOG_DIR = os.environ.get('LOG_DIR', 'logs')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_BACKUP_DAYS = int(os.environ.get('LOG_BACKUP_DAYS', 30))
+    LOG_SAMPLE_BURST = int(os.environ.get('LOG_SAMPLE_BURST', 50))
+    LOG_SAMPLE_RATE = int(os.environ.get('LOG_SAMPLE_RATE', 20))
+    # /metrics отвечает только адресам из списка (IP или подсети через запятую). Обратный прокси на том же хосте
+    # не должен проксировать /metrics: для приложения его запросы приходят с 127.0.0.1
+    METRICS_ENABLED = os.environ.get('METRICS', 'true').lower() in ('1', 'true', 'yes')
+    METRICS_ALLOWED_ADDRS = os.environ.get('METRICS_ALLOWED_ADDRS', '127.0.0.1,::1')
+    QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER', '').lower() in ('1', 'true', 'yes')
+    QUERY_PROFILER_REPEAT_THRESHOLD = int(os.environ.get('QUERY_PROFILER_REPEAT_THRESHOLD', 5))
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
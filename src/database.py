@@ -0,0 +1,60 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from models import db
+from logger import log_info
+
+
+def database_uri(uri):
+    # postgres:// (формат Heroku и др.) SQLAlchemy не принимает
+    if uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(config):
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite':
+        return {
+            "pool_size": config['DB_POOL_SIZE'],
+            "max_overflow": config['DB_MAX_OVERFLOW'],
+            "pool_recycle": config['DB_POOL_RECYCLE'],
+            "pool_pre_ping": config['DB_POOL_PRE_PING']
+        }
+    if url.database in (None, '', ':memory:'):
+        return {}
+    # Соединения с файлом SQLite не устаревают, поэтому pre-ping и recycle не нужны
+    return {"pool_size": config['DB_POOL_SIZE'], "max_overflow": config['DB_MAX_OVERFLOW']}
+
+
+def _sqlite_pragmas(config):
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+
+
+def init_database(app):
+    """Настраивает пул соединений и PRAGMA для SQLite, затем подключает db к приложению."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        log_info(f"Database engine: {engine.dialect.name}, pool {app.config['SQLALCHEMY_ENGINE_OPTIONS']}")
+        return
+
+    pragmas = _sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    log_info(f"Database engine: sqlite, {'; '.join(pragmas)}")
@@ -0,0 +1,136 @@
+import csv
+import json
+import click
+from flask.cli import with_appcontext
+from models import db, dialect_insert, Modul, Formula
+from catalog_snapshot import bump_catalog_version, rebuild_catalog_snapshot
+from logger import log_info, log_error
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+IMPORT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+FORMULA_FIELDS = ('name', 'description', 'formula', 'idmodul')
+
+
+def parse_rows(stream, fmt):
+    """Построчно читает текстовый поток NDJSON или CSV. Возвращает пары (номер строки, dict или текст ошибки)."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"Invalid JSON: {str(e)}"
+            continue
+        yield line_number, row if isinstance(row, dict) else "Each line must be a JSON object"
+
+
+def validate_row(row, module_ids):
+    """Возвращает (значения формулы, None) или (None, текст ошибки)."""
+    if isinstance(row, str):
+        return None, row
+    values = {field: row.get(field) for field in FORMULA_FIELDS}
+    missing = [field for field in FORMULA_FIELDS if values[field] in (None, '')]
+    if missing:
+        return None, f"Missing required fields: {', '.join(missing)}"
+    for field in ('name', 'description', 'formula'):
+        values[field] = str(values[field]).strip()
+    if len(values['name']) > 255:
+        return None, "Formula name is longer than 255 characters"
+    try:
+        values['idmodul'] = int(values['idmodul'])
+    except (TypeError, ValueError):
+        return None, f"Invalid idmodul: {values['idmodul']}"
+    if values['idmodul'] not in module_ids:
+        return None, f"Module with id {values['idmodul']} does not exist"
+    return values, None
+
+
+def _upsert_batch(batch, changed_modules):
+    names = [values['name'] for values in batch]
+    existing = dict(db.session.query(Formula.name, Formula.idmodul).filter(Formula.name.in_(names)))
+    # Изменились модули импортированных формул и модули, из которых обновлённые формулы переехали
+    changed_modules.update(values['idmodul'] for values in batch)
+    changed_modules.update(existing.values())
+    stmt = dialect_insert(Formula).values(batch)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[Formula.name],
+        set_={
+            'description': stmt.excluded.description,
+            'formula': stmt.excluded.formula,
+            'idmodul': stmt.excluded.idmodul
+        }
+    ))
+    return len(batch) - len(existing), len(existing)
+
+
+def import_formulas(rows, batch_size=IMPORT_BATCH_SIZE):
+    """Добавляет или обновляет (по уникальному name) формулы пачками в одной транзакции.
+
+    rows — итерируемое из parse_rows. Строки с ошибками пропускаются и попадают в отчёт.
+    """
+    module_ids = {module_id for (module_id,) in db.session.query(Modul.id)}
+    result = {"inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    seen_names = {}
+    changed_modules = set()
+    batch = []
+
+    def flush():
+        inserted, updated = _upsert_batch(batch, changed_modules)
+        result["inserted"] += inserted
+        result["updated"] += updated
+        batch.clear()
+
+    try:
+        for line_number, row in rows:
+            values, error = validate_row(row, module_ids)
+            if values and values['name'] in seen_names:
+                error = f"Duplicate formula name, already imported from line {seen_names[values['name']]}"
+            if error:
+                result["failed"] += 1
+                if len(result["errors"]) < MAX_REPORTED_ERRORS:
+                    result["errors"].append({"line": line_number, "message": error})
+                continue
+            seen_names[values['name']] = line_number
+            batch.append(values)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        if result["inserted"] or result["updated"]:
+            bump_catalog_version(changed_modules)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if result["inserted"] or result["updated"]:
+        rebuild_catalog_snapshot()
+    log_info(f"Imported formulas: {result['inserted']} inserted, {result['updated']} updated, {result['failed']} failed")
+    return result
+
+
+@click.command('import-formulas')
+@with_appcontext
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='Формат файла; по умолчанию определяется по расширению (.csv или .ndjson/.jsonl).')
+@click.option('--batch-size', type=int, default=IMPORT_BATCH_SIZE, show_default=True)
+def import_formulas_command(source, fmt, batch_size):
+    """Импортирует формулы из файла NDJSON/CSV ('-' — стандартный ввод)."""
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'ndjson')
+    try:
+        result = import_formulas(parse_rows(source, fmt), batch_size)
+    except Exception as e:
+        log_error(f"Formula import failed: {str(e)}")
+        raise click.ClickException(str(e))
+
+    for error in result["errors"]:
+        click.echo(f"line {error['line']}: {error['message']}", err=True)
+    click.echo(f"Inserted {result['inserted']}, updated {result['updated']}, failed {result['failed']}")
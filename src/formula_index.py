@@ -0,0 +1,39 @@
+import random
+import threading
+from models import db, Formula
+from catalog_snapshot import catalog_version
+from logger import log_info
+
+# Индекс названий формул в памяти процесса: (версия каталога, ((id, name), ...)).
+# Любое изменение формул увеличивает catalog_version в той же транзакции, поэтому индекс
+# перестраивается во всех воркерах (и после записи из CLI) при первом квизе после изменения.
+_lock = threading.Lock()
+_index = None
+
+
+def _build_index():
+    return tuple(db.session.query(Formula.id, Formula.name).order_by(Formula.id).tuples())
+
+
+def _get_names():
+    global _index
+    version = catalog_version()
+    index = _index
+    if index is not None and index[0] == version:
+        return index[1]
+
+    with _lock:
+        if _index is None or _index[0] != version:
+            _index = (version, _build_index())
+            log_info(f"Formula index built: {len(_index[1])} formulas at catalog version {version}")
+        return _index[1]
+
+
+def sample_distractors(formula_id, k=3, rng=random):
+    """Возвращает k случайных названий формул, кроме формулы formula_id."""
+    all_names = _get_names()
+    candidates = rng.sample(all_names, min(k + 1, len(all_names)))
+    names = [name for candidate_id, name in candidates if candidate_id != formula_id][:k]
+    if len(names) < k:
+        raise ValueError(f"Not enough formulas to pick {k} distractors")
+    return names
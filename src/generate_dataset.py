@@ -0,0 +1,225 @@
+"""Генератор синтетических данных для нагрузочного тестирования.
+
+Заполняет пустую базу пользователями, модулями, формулами, историей тестов, темами,
+достижениями, назначениями формул и сводной статистикой. Данные пишутся пачками через
+executemany, каждая пачка — одна транзакция. При одинаковом --seed результат детерминирован.
+
+Пример: python generate_dataset.py --database-uri sqlite:///instance/synthetic.db --users 20000 --tests 1000000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from migration import migrate_database
+from models import split_hashtags
+from achievements import ACHIEVEMENTS
+
+SECTIONS = ["Кинематика", "Динамика", "Статика", "Энергетика", "Термофизика"]
+# Как в quiz.py: в тесте хранится int(точность), в теме — точность без округления
+SUCCESS_RATES = [int(correct / 6 * 100) for correct in range(7)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk-load a synthetic dataset into an empty database.")
+    parser.add_argument('--database-uri', required=True, help='SQLAlchemy URI of the target (empty) database')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--tests', type=int, default=1000000, help='Total number of test rows')
+    parser.add_argument('--modules', type=int, default=len(SECTIONS))
+    parser.add_argument('--formulas-per-module', type=int, default=200)
+    parser.add_argument('--videos', type=int, default=1000)
+    parser.add_argument('--months', type=int, default=6, help='Spread test history over this many months')
+    parser.add_argument('--activity-alpha', type=float, default=1.2,
+                        help='Pareto shape of per-user activity (smaller means a heavier tail)')
+    parser.add_argument('--skill-alpha', type=float, default=4.0, help='Beta(alpha, beta) distribution of user skill')
+    parser.add_argument('--skill-beta', type=float, default=2.0)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+class BulkWriter:
+    """Пакетная вставка строк через executemany: одна транзакция на пачку."""
+
+    def __init__(self, engine, batch_size):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.placeholder = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+        self.sqlite = engine.dialect.name == 'sqlite'
+        self.counts = defaultdict(int)
+
+    def value(self, value):
+        # Формат хранения DateTime в SQLAlchemy для SQLite
+        if self.sqlite and isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+        return value
+
+    def insert(self, table, columns, rows):
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ', '.join([self.placeholder] * len(columns)))
+        batch = []
+        for row in rows:
+            batch.append(tuple(self.value(value) for value in row) if self.sqlite else row)
+            if len(batch) >= self.batch_size:
+                self._flush(sql, table, batch)
+                batch = []
+        if batch:
+            self._flush(sql, table, batch)
+
+    def _flush(self, sql, table, batch):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(sql, batch)
+        self.counts[table] += len(batch)
+
+
+def allocate_tests(rng, users, total_tests, alpha):
+    """Распределяет тесты по пользователям по степенному закону (не меньше одного теста на пользователя)."""
+    weights = [rng.paretovariate(alpha) for _ in range(users)]
+    scale = max(total_tests - users, 0) / sum(weights)
+    counts = [1 + int(weight * scale) for weight in weights]
+    remainder = total_tests - sum(counts)
+    for i in rng.sample(range(users), min(abs(remainder), users)):
+        if remainder > 0:
+            counts[i] += 1
+        elif counts[i] > 1:
+            counts[i] -= 1
+    return counts
+
+
+def streaks(days):
+    current = longest = 0
+    previous = None
+    for day in sorted(days):
+        current = current + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    engine = create_engine(args.database_uri)
+    migrate_database(engine)
+    with engine.connect() as conn:
+        if conn.execute(text('SELECT COUNT(*) FROM users')).scalar():
+            raise SystemExit('Target database is not empty; refusing to generate into it.')
+        if engine.dialect.name == 'sqlite':
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+
+    writer = BulkWriter(engine, args.batch_size)
+    now = datetime.now().replace(microsecond=0)
+    history_seconds = args.months * 30 * 24 * 3600
+
+    module_names = [SECTIONS[i] if i < len(SECTIONS) else f'Раздел {i + 1}' for i in range(args.modules)]
+    writer.insert('moduls', ('id', 'name', 'description'),
+                  ((i + 1, name, f'Модуль «{name}»') for i, name in enumerate(module_names)))
+
+    formula_rows = []
+    formula_id = 0
+    for module_id in range(1, args.modules + 1):
+        for i in range(args.formulas_per_module):
+            formula_id += 1
+            formula_rows.append((formula_id, f'{module_names[module_id - 1]}: формула {i + 1}',
+                                 'Синтетическая формула', f'F{i} = k{i} * x + {i}', module_id))
+    writer.insert('formulas', ('id', 'name', 'description', 'formula', 'idmodul'), formula_rows)
+    all_formula_ids = [row[0] for row in formula_rows]
+
+    writer.insert('users', ('id', 'login', 'password', 'nickname', 'status', 'profile_version'),
+                  ((user_id, f'synthuser{user_id}', 'Passw0rd', f'Студент {user_id}', 'beginner', 0)
+                   for user_id in range(1, args.users + 1)))
+
+    test_counts = allocate_tests(rng, args.users, args.tests, args.activity_alpha)
+    max_count = max(test_counts)
+    topic_rows, stats_rows, achievement_rows = [], [], []
+    user_module_rows, user_formula_rows = [], []
+    achievement_names = list(ACHIEVEMENTS)
+
+    def test_rows():
+        test_id = 0
+        for user_id, count in enumerate(test_counts, start=1):
+            skill = rng.betavariate(args.skill_alpha, args.skill_beta)
+            modules = rng.sample(range(1, args.modules + 1), rng.randint(1, args.modules))
+            per_section = defaultdict(lambda: [0, 0.0])
+            section_stats = defaultdict(lambda: {"tests": 0, "success_sum": 0, "best_success_rate": 0})
+            days = defaultdict(int)
+            total_success = best = 0
+            perfected = []
+            last_id = 0
+            for _ in range(count):
+                test_id += 1
+                module_id = rng.choice(modules)
+                section = module_names[module_id - 1]
+                if rng.random() < 0.3:
+                    section += " (Symbol Quiz)"
+                end_time = now - timedelta(seconds=rng.randrange(history_seconds))
+                start_time = end_time - timedelta(seconds=int(rng.lognormvariate(4.5, 0.6)))
+                correct = sum(rng.random() < skill for _ in range(6))
+                success_rate = SUCCESS_RATES[correct]
+
+                per_section[section][0] += 1
+                per_section[section][1] += correct / 6 * 100
+                section_stats[section]["tests"] += 1
+                section_stats[section]["success_sum"] += success_rate
+                section_stats[section]["best_success_rate"] = max(section_stats[section]["best_success_rate"], success_rate)
+                days[end_time.date()] += 1
+                total_success += success_rate
+                best = max(best, success_rate)
+                if success_rate == 100 and section not in perfected:
+                    perfected.append(section)
+                last_id = test_id
+                yield test_id, user_id, start_time, end_time, end_time.date(), success_rate, section
+
+            for name, (tests_passed, success_sum) in per_section.items():
+                topic_rows.append((user_id, name, tests_passed, success_sum, success_sum / tests_passed))
+
+            assigned = rng.sample(all_formula_ids, min(len(all_formula_ids), 1 + count * 2))
+            user_formula_rows.extend((user_id, formula) for formula in assigned)
+            user_module_rows.extend((user_id, module_id) for module_id in modules)
+
+            current, longest = streaks(days)
+            last_day = max(days)
+            stats_rows.append((
+                user_id, last_id, count,
+                json.dumps(section_stats, ensure_ascii=False),
+                best, total_success, last_day, days[last_day], current, longest,
+                json.dumps(perfected, ensure_ascii=False), len(assigned)
+            ))
+
+            earned = rng.sample(achievement_names, min(len(achievement_names), int(len(achievement_names) * count / max_count) + 1))
+            for name in earned:
+                achievement_rows.append((user_id, name, ACHIEVEMENTS[name]['description'],
+                                         (now - timedelta(seconds=rng.randrange(history_seconds))).date(),
+                                         ACHIEVEMENTS[name]['image_path']))
+
+    writer.insert('tests', ('id', 'user_id', 'start_time', 'end_time', 'date', 'success_rate', 'section'), test_rows())
+    writer.insert('topics', ('user_id', 'name', 'tests_passed', 'success_sum', 'success_rate'), topic_rows)
+    writer.insert('usersformulas', ('iduser', 'idformula'), user_formula_rows)
+    writer.insert('usersmoduls', ('iduser', 'idmodul'), user_module_rows)
+    writer.insert('achievements', ('user_id', 'achievement_name', 'achievement_description', 'date_achieved', 'image_path'),
+                  achievement_rows)
+    writer.insert('user_stats', ('user_id', 'last_test_id', 'total_tests', 'tests_per_section', 'best_success_rate',
+                                 'success_sum', 'last_active_date', 'tests_on_last_day', 'current_streak',
+                                 'longest_streak', 'sections_perfected', 'formulas_mastered'), stats_rows)
+    video_hashtags = [f'#{rng.choice(module_names)}' for _ in range(args.videos)]
+    writer.insert('videos', ('id', 'link', 'title', 'description', 'hashtag'),
+                  ((i + 1, f'https://video.example/{i}', f'Видео {i}', 'Синтетическое видео', hashtag)
+                   for i, hashtag in enumerate(video_hashtags)))
+    writer.insert('video_hashtags', ('video_id', 'hashtag'),
+                  ((i + 1, tag) for i, hashtag in enumerate(video_hashtags) for tag in split_hashtags(hashtag)))
+    return writer.counts
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    counts = generate(args)
+    elapsed = time.perf_counter() - started
+    for table, count in counts.items():
+        print(f'{table}: {count} rows', file=sys.stderr)
+    print(f'Generated dataset in {elapsed:.1f}s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,16 @@
 import jwt
+import hashlib
+import time
+import uuid
 from config import Config
 from datetime import datetime, timedelta
 from flask import request
+from cache_utils import LRUCache
 from logger import log_info, log_error, log_debug 
 
+# Кэш проверенных токенов: sha256(токен) -> декодированные claims (хранятся до истечения exp)
+_verified_tokens = LRUCache(Config.JWT_CACHE_MAX_ENTRIES)
+
 def create_token(user_id, nickname):
     try:
         payload = {
@@ -19,9 +26,20 @@ def create_token(user_id, nickname):
         raise  # Повторно выбрасываем исключение, если нужно обработать выше
 
 def verify_token(token):
+    key = hashlib.sha256(token.encode()).digest()
+    decoded_token = _verified_tokens.get(key)
+    if decoded_token is not None:
+        # Токен истекает ровно в момент exp, как и при проверке PyJWT
+        if "exp" in decoded_token and time.time() >= decoded_token["exp"]:
+            _verified_tokens.pop(key)
+            log_error(f"Token verification failed: Token expired")
+            return {"error": "Token expired", "status": 401}
+        return decoded_token
+
     try:
         decoded_token = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
-        log_info(f"Token verified successfully for user_id: {decoded_token['user_id']}")
+        _verified_tokens.set(key, decoded_token)
+        log_debug("Token verified successfully for user_id: %s", decoded_token['user_id'])
         return decoded_token
     except jwt.ExpiredSignatureError:
         log_error(f"Token verification failed: Token expired")
@@ -33,6 +51,40 @@ def verify_token(token):
         log_error(f"Unexpected error during token verification: {str(e)}")
         return {"error": "Token verification error", "status": 500}
 
+def create_quiz_token(kind, user_id, module_id, formula_ids, start_time):
+    try:
+        payload = {
+            "k": kind,
+            "u": user_id,
+            "m": module_id,
+            "f": formula_ids,
+            # Идентификатор токена: при отправке сохраняется в tests.quiz_token_id, повторная отправка отклоняется
+            "j": uuid.uuid4().hex,
+            "t": int(start_time.timestamp()),
+            "exp": datetime.utcnow() + timedelta(minutes=Config.QUIZ_TOKEN_TTL_MINUTES)
+        }
+        token = jwt.encode(payload, Config.SECRET_KEY, algorithm="HS256")
+        log_debug("Quiz token created for user_id: %s, module: %s", user_id, module_id)
+        return token
+    except Exception as e:
+        log_error(f"Failed to create quiz token for user_id: {user_id}: {str(e)}")
+        raise
+
+def verify_quiz_token(token, kind, user_id):
+    try:
+        decoded_token = jwt.decode(token, Config.SECRET_KEY, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        log_error(f"Quiz token verification failed for user_id {user_id}: Token expired")
+        return {"error": "Quiz token expired", "status": 400}
+    except jwt.InvalidTokenError:
+        log_error(f"Quiz token verification failed for user_id {user_id}: Invalid token")
+        return {"error": "Invalid quiz token", "status": 400}
+
+    if decoded_token.get("k") != kind or decoded_token.get("u") != user_id or not decoded_token.get("j"):
+        log_error(f"Quiz token verification failed for user_id {user_id}: Token issued for another quiz or user")
+        return {"error": "Invalid quiz token", "status": 400}
+    return decoded_token
+
 def IsAuthorized():
     token = request.headers.get("Authorization")
     if not token:
@@ -41,11 +93,14 @@ def IsAuthorized():
 
     if token.startswith("Bearer "):
         token = token.split(" ")[1]
-        log_debug(f"Extracted Bearer token: {token[:10]}...") 
+        log_debug("Extracted Bearer token: %s...", token[:10]) 
 
     result = verify_token(token)
     if "error" in result:
         log_error(f"Authorization failed: {result['error']}")
     else:
-        log_info(f"User authorized successfully: user_id {result['user_id']}")
-    return result
\ No newline at end of file
+        log_debug("User authorized successfully: user_id %s", result['user_id'])
+    return result
+
+def token_cache_stats():
+    return _verified_tokens.stats()
\ No newline at end of file
@@ -1,23 +1,178 @@
+import atexit
+import gzip
 import logging
-from datetime import datetime
+import os
+import queue
+import shutil
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler, WatchedFileHandler
+from config import Config
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f'logs/app_{datetime.now().strftime("%Y%m%d")}.log'),
-        logging.StreamHandler()
-    ]
-)
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки ротации
+    fcntl = None
 
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+# Ротированные файлы сжимаются: app.log.2024-01-31 -> app.log.2024-01-31.gz
+def _gzip_namer(name):
+    return name + '.gz'
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+# Ротацию выполняет только процесс, настроивший логирование (мастер при gunicorn --preload):
+# по расписанию, даже если сам он ничего не пишет. Дочерние процессы пишут в тот же файл через
+# WatchedFileHandler, который переоткрывает файл после переименования мастером.
+def _rollover_loop(handler):
+    while True:
+        time.sleep(max(handler.rolloverAt - time.time(), 1))
+        handler.acquire()
+        try:
+            if time.time() >= handler.rolloverAt:
+                handler.doRollover()
+        finally:
+            handler.release()
+
+
+def _worker_handler(handler):
+    if not isinstance(handler, TimedRotatingFileHandler):
+        return handler
+    handler.close()
+    watched = WatchedFileHandler(handler.baseFilename, encoding='utf-8')
+    watched.setFormatter(handler.formatter)
+    return watched
+
+
+class LockedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """Ротация под межпроцессной блокировкой: файл переименовывает первый процесс, остальные только переоткрывают его.
+
+    Нужна, когда логирование настраивает каждый процесс (без --preload, перезагрузчик flask run).
+    """
+
+    def doRollover(self):
+        with open(self.baseFilename + '.lock', 'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self._rotated_elsewhere():
+                self.stream.close()
+                self.stream = self._open()
+                current_time = int(time.time())
+                rollover_at = self.computeRollover(current_time)
+                while rollover_at <= current_time:
+                    rollover_at += self.interval
+                self.rolloverAt = rollover_at
+            else:
+                super().doRollover()
+
+    def _rotated_elsewhere(self):
+        # Открытый нами файл уже переименован другим процессом: по пути лежит другой inode (или ничего)
+        if self.stream is None:
+            return False
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает первые burst сообщений с пометкой sampled в секунду, дальше — каждое rate-е."""
+
+    def __init__(self, burst, rate):
+        super().__init__()
+        self.burst = burst
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._window = 0
+        self._count = 0
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False):
+            return True
+        with self._lock:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window, self._count = window, 0
+            self._count += 1
+            count = self._count
+        return count <= self.burst or count % self.rate == 0
+
+
+def _setup_logging():
+    os.makedirs(Config.LOG_DIR, exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = LockedTimedRotatingFileHandler(
+        os.path.join(Config.LOG_DIR, 'app.log'),
+        when='midnight',
+        backupCount=Config.LOG_BACKUP_DAYS,
+        encoding='utf-8'
+    )
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
+    file_handler.setFormatter(formatter)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    # Запись в файл и консоль выполняется в фоновом потоке слушателя очереди
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # QueueHandler подставляет аргументы в сообщение; время и уровень добавят обработчики слушателя
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    queue_handler.addFilter(SamplingFilter(Config.LOG_SAMPLE_BURST, Config.LOG_SAMPLE_RATE))
+    logging.basicConfig(level=Config.LOG_LEVEL, handlers=[queue_handler])
+
+    global _listener, _queue_handler
+    _queue_handler = queue_handler
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    threading.Thread(target=_rollover_loop, args=(file_handler,), name='log-rollover', daemon=True).start()
+
+
+# Поток слушателя не переживает fork: дочерний процесс запускает своего слушателя на новой очереди
+# (записи, оставшиеся в очереди родителя, запишет родитель) и пишет в файл без ротации (её выполняет родитель)
+def _restart_listener_after_fork():
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    handlers = [_worker_handler(handler) for handler in _listener.handlers]
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    _listener.stop()
+
+
+_listener = None
+_queue_handler = None
+_setup_logging()
+atexit.register(_stop_listener)
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
 
 logger = logging.getLogger('PhysicsLearningPlatform')
 
-def log_info(message):
-    logger.info(message)
+# Сообщения принимают аргументы в стиле %: строка форматируется, только если уровень включён
+def log_info(message, *args):
+    logger.info(message, *args)
+
+def log_sampled(message, *args):
+    """INFO-сообщение, которое под нагрузкой записывается выборочно (частые строки на каждый запрос)."""
+    logger.info(message, *args, extra={'sampled': True})
+
+def log_warning(message, *args):
+    logger.warning(message, *args)
 
-def log_error(message):
-    logger.error(message)
+def log_error(message, *args):
+    logger.error(message, *args)
 
-def log_debug(message):
-    logger.debug(message)
\ No newline at end of file
+def log_debug(message, *args):
+    logger.debug(message, *args)
@@ -0,0 +1,188 @@
+import ipaddress
+import threading
+import time
+from collections import defaultdict
+from flask import g, request, has_request_context, Response, current_app, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from jwt_utils import token_cache_stats
+from profile_cache import cache_stats as profile_cache_stats
+from catalog_cache import cache_stats as catalog_cache_stats
+from achievement_queue import queue_stats
+
+# Метрики запросов в формате Prometheus: задержка по маршрутам, коды ответов,
+# количество SQL-запросов и время в БД на запрос, число запросов в обработке.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+_lock = threading.Lock()
+_requests_total = defaultdict(int)
+_histograms = {}
+_in_flight = 0
+_listeners_installed = False
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _observe(name, buckets, labels, value):
+    key = (name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram(buckets)
+    histogram.observe(value)
+
+
+def init_metrics(app):
+    global _listeners_installed
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.config['METRICS_ALLOWED_NETWORKS'] = [
+        ipaddress.ip_network(addr.strip()) for addr in app.config['METRICS_ALLOWED_ADDRS'].split(',') if addr.strip()
+    ]
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    if not _listeners_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listeners_installed = True
+
+
+def _before_request():
+    global _in_flight
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_count = 0
+    g.metrics_db_time = 0.0
+    g.metrics_status = 500
+    with _lock:
+        _in_flight += 1
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    global _in_flight
+    if 'metrics_start' not in g:
+        return
+    elapsed = time.perf_counter() - g.metrics_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('method', request.method), ('route', route))
+    with _lock:
+        _in_flight -= 1
+        _requests_total[labels + (('status', str(g.metrics_status)),)] += 1
+        _observe('http_request_duration_seconds', LATENCY_BUCKETS, labels, elapsed)
+        _observe('http_request_sql_statements', SQL_COUNT_BUCKETS, labels, g.metrics_sql_count)
+        _observe('http_request_db_seconds', LATENCY_BUCKETS, labels, g.metrics_db_time)
+
+
+# Время начала хранится в контексте выполнения: для упавшего запроса after_cursor_execute не вызывается,
+# и контекст просто освобождается вместе с ним
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_query_start', None)
+    if started is not None and has_request_context() and 'metrics_start' in g:
+        g.metrics_sql_count += 1
+        g.metrics_db_time += time.perf_counter() - started
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+HELP = {
+    'http_requests_total': ('counter', 'Total HTTP requests by route and status.'),
+    'http_requests_in_flight': ('gauge', 'HTTP requests currently being processed.'),
+    'http_request_duration_seconds': ('histogram', 'Request latency in seconds.'),
+    'http_request_sql_statements': ('histogram', 'SQL statements executed per request.'),
+    'http_request_db_seconds': ('histogram', 'Time spent in the database per request, in seconds.'),
+    'app_cache_hits_total': ('counter', 'In-process cache hits.'),
+    'app_cache_misses_total': ('counter', 'In-process cache misses.'),
+    'app_cache_entries': ('gauge', 'Entries currently held by an in-process cache.'),
+    'achievement_queue_events_total': ('counter', 'Achievement queue events handled, by outcome.'),
+    'achievement_queue_pending': ('gauge', 'Achievement queue events waiting to be processed.'),
+}
+
+
+def render_metrics():
+    lines = []
+
+    def header(name):
+        metric_type, text = HELP[name]
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+    with _lock:
+        header('http_requests_total')
+        for labels, value in sorted(_requests_total.items()):
+            lines.append(f'http_requests_total{_format_labels(labels)} {value}')
+
+        header('http_requests_in_flight')
+        lines.append(f'http_requests_in_flight {_in_flight}')
+
+        for name in ('http_request_duration_seconds', 'http_request_sql_statements', 'http_request_db_seconds'):
+            header(name)
+            for (metric, labels), histogram in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+
+    caches = {'jwt': token_cache_stats(), 'profile': profile_cache_stats(), 'catalog': catalog_cache_stats()}
+    for name, key in (('app_cache_hits_total', 'hits'), ('app_cache_misses_total', 'misses'), ('app_cache_entries', 'size')):
+        header(name)
+        for cache, stats in caches.items():
+            lines.append(f'{name}{_format_labels((("cache", cache),))} {stats[key]}')
+
+    queue = queue_stats()
+    header('achievement_queue_events_total')
+    for state in ('processed', 'retried', 'failed'):
+        lines.append(f'achievement_queue_events_total{_format_labels((("state", state),))} {queue[state]}')
+    header('achievement_queue_pending')
+    lines.append(f'achievement_queue_pending {queue["pending"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _metrics_allowed():
+    try:
+        addr = ipaddress.ip_address(request.remote_addr)
+    except ValueError:
+        return False
+    return any(addr in network for network in current_app.config['METRICS_ALLOWED_NETWORKS'])
+
+
+def metrics_view():
+    # Для остальных адресов эндпоинт не существует
+    if not _metrics_allowed():
+        abort(404)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
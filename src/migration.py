@@ -1,82 +1,179 @@
-from sqlite3 import connect
-from logger import log_info, log_error, log_debug 
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from models import db, split_hashtags
+from logger import log_info, log_error, log_debug
 
-def migrate_database():
-    try:
-        conn = connect('instance/db_sqlite.db')
-        cursor = conn.cursor()
-        log_info("Successfully connected to SQLite database 'instance/db_sqlite.db'")
-    except Exception as e:
-        log_error(f"Failed to connect to SQLite database: {str(e)}")
+# Миграции применяются по порядку номеров; номер применённой миграции записывается в schema_version.
+# Недостающие таблицы создаёт db.create_all перед миграциями, поэтому миграции только изменяют
+# существующие таблицы и должны корректно отрабатывать и на старой базе, и на только что созданной.
+# Новая модель тоже требует новой записи в MIGRATIONS, иначе create_all не будет вызван.
+
+
+def _columns(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def _indexes(conn, table):
+    return {index['name'] for index in inspect(conn).get_indexes(table)}
+
+
+def _add_column(conn, table, column, definition):
+    if column in _columns(conn, table):
+        return False
+    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+    log_info(f"Added column '{column}' to '{table}' table")
+    return True
+
+
+def add_test_times(conn):
+    for column in ('start_time', 'end_time'):
+        # Заполнение пустых значений нужно только сразу после добавления столбца
+        if _add_column(conn, 'tests', column, 'TIMESTAMP'):
+            conn.execute(text(f'UPDATE tests SET {column} = CURRENT_TIMESTAMP WHERE {column} IS NULL'))
+
+
+def add_achievement_image_path(conn):
+    _add_column(conn, 'achievements', 'image_path', 'VARCHAR(255)')
+
+
+def merge_duplicate_topics(conn):
+    _add_column(conn, 'topics', 'success_sum', 'FLOAT')
+    if 'uq_topics_user_name' in _indexes(conn, 'topics'):
         return
+    conn.execute(text('UPDATE topics SET success_sum = success_rate * tests_passed WHERE success_sum IS NULL'))
+    # Объединение дублирующихся тем пользователя перед созданием уникального индекса
+    conn.execute(text('''
+        UPDATE topics SET
+            tests_passed = (SELECT SUM(t.tests_passed) FROM topics t WHERE t.user_id = topics.user_id AND t.name = topics.name),
+            success_sum = (SELECT SUM(t.success_sum) FROM topics t WHERE t.user_id = topics.user_id AND t.name = topics.name)
+        WHERE id IN (SELECT MIN(id) FROM topics GROUP BY user_id, name HAVING COUNT(*) > 1)
+    '''))
+    conn.execute(text('DELETE FROM topics WHERE id NOT IN (SELECT MIN(id) FROM topics GROUP BY user_id, name)'))
+    conn.execute(text('UPDATE topics SET success_rate = success_sum / tests_passed WHERE tests_passed > 0'))
+    conn.execute(text('CREATE UNIQUE INDEX uq_topics_user_name ON topics (user_id, name)'))
+    log_info("Merged duplicate topics and created unique index 'uq_topics_user_name'")
 
-    try:
-        cursor.execute('ALTER TABLE tests ADD COLUMN start_time DATETIME')
-        log_info("Added column 'start_time' to 'tests' table")
-    except Exception as e:
-        log_info(f"Column 'start_time' already exists in 'tests' table, skipping: {str(e)}")
 
-    try:
-        cursor.execute('UPDATE tests SET start_time = CURRENT_TIMESTAMP WHERE start_time IS NULL')
-        log_info("Updated 'start_time' with CURRENT_TIMESTAMP where NULL")
-    except Exception as e:
-        log_error(f"Failed to update 'start_time' in 'tests' table: {str(e)}")
+def add_profile_version(conn):
+    _add_column(conn, 'users', 'profile_version', 'INTEGER NOT NULL DEFAULT 0')
 
-    try:
-        cursor.execute('ALTER TABLE tests ADD COLUMN end_time DATETIME')
-        log_info("Added column 'end_time' to 'tests' table")
-    except Exception as e:
-        log_info(f"Column 'end_time' already exists in 'tests' table, skipping: {str(e)}")
 
-    try:
-        cursor.execute('UPDATE tests SET end_time = CURRENT_TIMESTAMP WHERE end_time IS NULL')
-        log_info("Updated 'end_time' with CURRENT_TIMESTAMP where NULL")
-    except Exception as e:
-        log_error(f"Failed to update 'end_time' in 'tests' table: {str(e)}")
+def add_hot_query_indexes(conn):
+    indexes = [
+        ('ix_tests_user_end_time', 'tests', 'user_id, end_time'),
+        ('ix_tests_user_section_success', 'tests', 'user_id, section, success_rate'),
+        ('ix_tests_user_date', 'tests', 'user_id, date'),
+        ('ix_achievements_user_name', 'achievements', 'user_id, achievement_name'),
+        ('ix_formulas_idmodul', 'formulas', 'idmodul'),
+    ]
+    for name, table, columns in indexes:
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
 
-    try:
-        cursor.execute('ALTER TABLE achievements ADD COLUMN image_path VARCHAR(255)')
-        log_info("Added column 'image_path' to 'achievements' table")
-    except Exception as e:
-        log_info(f"Column 'image_path' already exists in 'achievements' table, skipping: {str(e)}")
 
-    try:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS achievements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                achievement_name VARCHAR(255) NOT NULL,
-                achievement_description TEXT NOT NULL,
-                date_achieved DATE NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        log_info("Created or verified 'achievements' table")
-    except Exception as e:
-        log_error(f"Failed to create 'achievements' table: {str(e)}")
+def seed_catalog_version(conn):
+    if conn.execute(text('SELECT 1 FROM catalog_version WHERE id = 1')).first() is None:
+        conn.execute(text('INSERT INTO catalog_version (id, version) VALUES (1, 1)'))
+
+
+def add_module_versions(conn):
+    if _add_column(conn, 'moduls', 'version', 'INTEGER NOT NULL DEFAULT 0'):
+        conn.execute(text('UPDATE moduls SET version = (SELECT version FROM catalog_version WHERE id = 1)'))
+
+
+
+def backfill_video_hashtags(conn):
+    conn.execute(text('DELETE FROM video_hashtags'))
+    rows = [{'video_id': video_id, 'hashtag': tag}
+            for video_id, hashtag in conn.execute(text('SELECT id, hashtag FROM videos'))
+            for tag in split_hashtags(hashtag)]
+    if rows:
+        conn.execute(text('INSERT INTO video_hashtags (video_id, hashtag) VALUES (:video_id, :hashtag)'), rows)
+
+
+
+def add_quiz_token_id(conn):
+    _add_column(conn, 'tests', 'quiz_token_id', 'VARCHAR(32)')
+    conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_tests_quiz_token_id ON tests (quiz_token_id)'))
 
-    try:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS videos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                link VARCHAR(255) NOT NULL,
-                title VARCHAR(255) NOT NULL,
-                description TEXT,
-                hashtag VARCHAR(255)
-            )
-        ''')
-        log_info("Created or verified 'videos' table")
-    except Exception as e:
-        log_error(f"Failed to create 'videos' table: {str(e)}")
 
+# tests_per_section теперь хранит по разделу число тестов, сумму и лучший результат.
+# Старые строки содержат только счётчики, поэтому удаляются: get_user_stats и record_test
+# строят их заново по истории тестов при первом обращении
+def reset_user_stats(conn):
+    conn.execute(text('DELETE FROM user_stats'))
+
+
+MIGRATIONS = [
+    (1, "Add start_time/end_time to tests", add_test_times),
+    (2, "Add image_path to achievements", add_achievement_image_path),
+    (3, "Merge duplicate topics, add success_sum and unique (user_id, name)", merge_duplicate_topics),
+    (4, "Add profile_version to users", add_profile_version),
+    (5, "Add composite indexes for hot queries", add_hot_query_indexes),
+    (6, "Create catalog_version counter", seed_catalog_version),
+    (7, "Add per-module catalog version", add_module_versions),
+    (8, "Backfill video_hashtags from videos.hashtag", backfill_video_hashtags),
+    (9, "Add unique quiz_token_id to tests", add_quiz_token_id),
+    (10, "Store per-section sums in user_stats", reset_user_stats),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(engine):
+    """Номер последней применённой миграции или None, если таблицы schema_version ещё нет."""
     try:
-        conn.commit()
-        log_info("Database changes committed successfully")
-    except Exception as e:
-        log_error(f"Failed to commit database changes: {str(e)}")
-    
+        with engine.connect() as conn:
+            return conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar() or 0
+    except Exception:
+        return None
+
+
+def migrate_database(engine=None):
+    engine = engine or db.engine
+    version = current_version(engine)
+    if version == LATEST_VERSION:
+        log_debug(f"Database schema is up to date (version {version})")
+        return version
+
+    db.metadata.create_all(engine)
+    log_info("Database tables created or verified")
+
+    if version is None:
+        with engine.begin() as conn:
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP NOT NULL
+                )
+            '''))
+        log_info("Created 'schema_version' table")
+        version = 0
+
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            # Каждая миграция выполняется в своей транзакции вместе с записью о ней
+            with engine.begin() as conn:
+                migrate(conn)
+                conn.execute(text('INSERT INTO schema_version (version, description, applied_at) '
+                                  'VALUES (:version, :description, CURRENT_TIMESTAMP)'),
+                             {"version": number, "description": description})
+            log_info(f"Applied migration {number}: {description}")
+        except Exception as e:
+            log_error(f"Migration {number} ({description}) failed: {str(e)}")
+            raise
+        version = number
+    return version
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Создаёт таблицы и применяет недостающие миграции. Запускается один раз перед стартом воркеров."""
     try:
-        conn.close()
-        log_info("Database connection closed")
+        version = migrate_database()
+        click.echo(f"Database schema is at version {version}")
     except Exception as e:
-        log_error(f"Failed to close database connection: {str(e)}")
\ No newline at end of file
+        raise click.ClickException(str(e))
@@ -1,13 +1,25 @@
+import json
+import re
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import validates
+from datetime import datetime, date
 
 db = SQLAlchemy()
 
+def dialect_insert(model):
+    """INSERT с поддержкой ON CONFLICT для используемой БД (SQLite или PostgreSQL)."""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
 class Modul(db.Model):
     __tablename__ = 'moduls'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
+    # Версия каталога, при которой менялся модуль или его формулы (для /catalog?since_version=)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def to_dict(self):
         return {
@@ -24,6 +36,7 @@ class User(db.Model):
     nickname = db.Column(db.String(255))
     status = db.Column(db.String(50))
     avatar = db.Column(db.String(255))
+    profile_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def to_dict(self):
         return {
@@ -36,6 +49,9 @@ class User(db.Model):
 
 class Formula(db.Model):
     __tablename__ = 'formulas'
+    __table_args__ = (
+        db.Index('ix_formulas_idmodul', 'idmodul'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False, unique=True)
     description = db.Column(db.Text, nullable=False)
@@ -65,6 +81,12 @@ class UsersModuls(db.Model):
 
 class Test(db.Model):
     __tablename__ = 'tests'
+    __table_args__ = (
+        db.Index('ix_tests_user_end_time', 'user_id', 'end_time'),
+        db.Index('ix_tests_user_section_success', 'user_id', 'section', 'success_rate'),
+        db.Index('ix_tests_user_date', 'user_id', 'date'),
+        db.Index('uq_tests_quiz_token_id', 'quiz_token_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False, default=datetime.now)
@@ -72,6 +94,8 @@ class Test(db.Model):
     date = db.Column(db.Date, nullable=False)
     success_rate = db.Column(db.Integer, nullable=False)
     section = db.Column(db.String(255), nullable=False)
+    # Идентификатор подписанного токена квиза (режим stateless); NULL для квизов из сессии
+    quiz_token_id = db.Column(db.String(32))
 
     def to_dict(self):
         return {
@@ -100,21 +124,28 @@ class Test(db.Model):
 
 class Topic(db.Model):
     __tablename__ = 'topics'
+    __table_args__ = (
+        db.Index('uq_topics_user_name', 'user_id', 'name', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.String(255), nullable=False)
     tests_passed = db.Column(db.Integer, nullable=False)
-    success_rate = db.Column(db.Integer, nullable=False)
+    success_sum = db.Column(db.Float, nullable=False, default=0)
+    success_rate = db.Column(db.Float, nullable=False)
 
     def to_dict(self):
         return {
             "name": self.name,
             "tests_passed": self.tests_passed,
-            "success_rate": self.success_rate
+            "success_rate": round(self.success_rate, 2)
         }
 
 class Achievement(db.Model):
     __tablename__ = 'achievements'
+    __table_args__ = (
+        db.Index('ix_achievements_user_name', 'user_id', 'achievement_name'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     achievement_name = db.Column(db.String(255), nullable=False)
@@ -129,7 +160,66 @@ class Achievement(db.Model):
             "date_achieved": self.date_achieved.strftime('%d.%m.%Y'),
             "image_path": self.image_path
         }
+
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    last_test_id = db.Column(db.Integer, nullable=False, default=0)
+    total_tests = db.Column(db.Integer, nullable=False, default=0)
+    tests_per_section = db.Column(db.Text, nullable=False, default='{}')
+    best_success_rate = db.Column(db.Integer, nullable=False, default=0)
+    success_sum = db.Column(db.Float, nullable=False, default=0)
+    last_active_date = db.Column(db.Date)
+    tests_on_last_day = db.Column(db.Integer, nullable=False, default=0)
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    longest_streak = db.Column(db.Integer, nullable=False, default=0)
+    sections_perfected = db.Column(db.Text, nullable=False, default='[]')
+    formulas_mastered = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        # Стрик считается текущим, только если пользователь занимался сегодня или вчера
+        streak_alive = self.last_active_date is not None and \
+            (date.today() - self.last_active_date).days <= 1
+        per_section = json.loads(self.tests_per_section)
+        return {
+            "total_tests": self.total_tests,
+            "tests_per_section": {name: section["tests"] for name, section in per_section.items()},
+            "sections": [
+                {
+                    "section": name,
+                    "tests": section["tests"],
+                    "average_success_rate": round(section["success_sum"] / section["tests"], 2),
+                    "best_success_rate": section["best_success_rate"]
+                }
+                for name, section in per_section.items()
+            ],
+            "best_success_rate": self.best_success_rate,
+            "average_success_rate": round(self.success_sum / self.total_tests, 2) if self.total_tests else 0,
+            "last_active_date": self.last_active_date.strftime('%d.%m.%Y') if self.last_active_date else None,
+            "current_streak": self.current_streak if streak_alive else 0,
+            "longest_streak": self.longest_streak,
+            "formulas_mastered": self.formulas_mastered
+        }
     
+class CatalogVersion(db.Model):
+    """Единственная строка (id = 1) со счётчиком версии каталога модулей и формул."""
+    __tablename__ = 'catalog_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+HASHTAG_MAX_LENGTH = 100
+
+
+def split_hashtags(text):
+    """Нормализованные хэштеги из свободной строки: '#Механика, #кинематика' -> ['механика', 'кинематика']."""
+    tags = []
+    for part in re.split(r'[\s,;#]+', text or ''):
+        tag = part.lower()[:HASHTAG_MAX_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
 class Video(db.Model):
     __tablename__ = 'videos'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -137,6 +227,14 @@ class Video(db.Model):
     title = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
     hashtag = db.Column(db.String(255))
+    tags = db.relationship('VideoHashtag', cascade='all, delete-orphan')
+
+    # Таблица video_hashtags всегда соответствует строке hashtag
+    @validates('hashtag')
+    def _sync_tags(self, key, value):
+        existing = {tag.hashtag: tag for tag in self.tags}
+        self.tags = [existing.get(name) or VideoHashtag(hashtag=name) for name in split_hashtags(value)]
+        return value
 
     def to_dict(self):
         return {
@@ -145,4 +243,13 @@ class Video(db.Model):
             'title': self.title,
             'description': self.description,
             'hashtag': self.hashtag
-        }
\ No newline at end of file
+        }
+
+class VideoHashtag(db.Model):
+    """Нормализованный хэштег видео для фильтрации списка видео."""
+    __tablename__ = 'video_hashtags'
+    __table_args__ = (
+        db.Index('ix_video_hashtags_hashtag_video', 'hashtag', 'video_id'),
+    )
+    video_id = db.Column(db.Integer, db.ForeignKey('videos.id'), primary_key=True)
+    hashtag = db.Column(db.String(HASHTAG_MAX_LENGTH), primary_key=True)
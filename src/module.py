@@ -1,7 +1,12 @@
+from collections import Counter
 from flask import Blueprint, jsonify, request
-from models import db, Modul, Formula, User, UsersFormulas, UsersModuls
+from models import db, dialect_insert, Modul, Formula, User, UsersFormulas, UsersModuls
 from flask_restx import Api, Resource, fields, Namespace
-from logger import log_info, log_error, log_debug 
+from logger import log_info, log_sampled, log_error, log_debug 
+from user_stats import count_assigned_formula, count_assigned_formulas
+from profile_cache import bump_profile_version, bump_profile_versions
+from catalog_cache import catalog_response
+from catalog_snapshot import catalog_document
 
 module_ns = Namespace('module', description='Operations related to modules')
 
@@ -14,6 +19,15 @@ user_module_model = module_ns.model('UserModule', {
     'message': fields.String(description='Message indicating assignment success')
 })
 
+bulk_assign_result_model = module_ns.model('BulkAssignResult', {
+    'inserted': fields.Integer(description='Количество новых назначений'),
+    'skipped': fields.Integer(description='Количество уже существовавших назначений'),
+    'invalid': fields.List(fields.Raw, description='Пары с несуществующими пользователями или формулами/модулями')
+})
+
+BULK_ASSIGN_MAX_PAIRS = 10000
+BULK_INSERT_CHUNK = 5000
+
 # Получение всех модулей
 @module_ns.route('/api/modules', methods=['GET'])
 class ModuleList(Resource):
@@ -21,9 +35,9 @@ class ModuleList(Resource):
     def get(self):
         """Получение всех модулей."""
         try:
-            result = list_modules()
-            log_info(f"Retrieved {len(result)} modules successfully")
-            return result
+            response = catalog_response('modules', lambda version: list_modules())
+            log_sampled("Retrieved modules successfully (status %s)", response.status_code)
+            return response
         except Exception as e:
             log_error(f"Error retrieving modules: {str(e)}")
             return {"message": "Internal server error"}, 500
@@ -35,13 +49,38 @@ class FormulaList(Resource):
     def get(self, module_id):
         """Получение всех формул по ID модуля."""
         try:
-            result = list_formulas(module_id)
-            log_info(f"Retrieved {len(result)} formulas for module_id {module_id}")
-            return result
+            response = catalog_response(f'formulas/{module_id}', lambda version: list_formulas(module_id))
+            log_sampled("Retrieved formulas for module_id %s (status %s)", module_id, response.status_code)
+            return response
         except Exception as e:
             log_error(f"Error retrieving formulas for module_id {module_id}: {str(e)}")
             return {"message": f"Module {module_id} not found or error occurred"}, 404
 
+# Весь каталог одним запросом: модули с вложенными формулами
+@module_ns.route('/api/catalog', methods=['GET'])
+class Catalog(Resource):
+    @module_ns.doc('get_catalog', params={
+        'since_version': 'Версия каталога из предыдущего ответа: вернуть только модули, изменённые после неё'
+    })
+    def get(self):
+        """Получение модулей с формулами; с since_version — только изменённых модулей."""
+        since_version = request.args.get('since_version')
+        if since_version is not None:
+            try:
+                since_version = int(since_version)
+            except ValueError:
+                return {"message": "since_version must be an integer"}, 400
+        try:
+            if since_version is None:
+                response = catalog_response('catalog', build_catalog)
+            else:
+                response = catalog_response(f'catalog/since/{since_version}', lambda version: build_catalog(version, since_version))
+            log_sampled("Retrieved catalog since version %s (status %s)", since_version, response.status_code)
+            return response
+        except Exception as e:
+            log_error(f"Error retrieving catalog: {str(e)}")
+            return {"message": "Internal server error"}, 500
+
 # Назначить формулу пользователю
 @module_ns.route('/api/assign_formula_to_user', methods=['POST'])
 class AssignFormula(Resource):
@@ -64,6 +103,8 @@ class AssignFormula(Resource):
         try:
             user_formula = UsersFormulas(iduser=user_id, idformula=formula_id)
             db.session.add(user_formula)
+            count_assigned_formula(user_id)
+            bump_profile_version(user_id)
             db.session.commit()
             log_info(f"Formula {formula_id} assigned to user {user_id}")
             return {"message": f"Formula {formula_id} assigned to user {user_id}"}, 200
@@ -102,6 +143,132 @@ class AssignModule(Resource):
             log_error(f"Failed to assign module {module_id} to user {user_id}: {str(e)}")
             return {"message": "Database error"}, 500
 
+# Массовое назначение формул: список пар или все формулы модуля для списка пользователей
+@module_ns.route('/api/assign_formulas_to_users', methods=['POST'])
+class AssignFormulasBulk(Resource):
+    @module_ns.doc('assign_formulas_to_users')
+    @module_ns.expect(module_ns.model('AssignFormulasBulkPayload', {
+        'pairs': fields.List(fields.Raw, description='[{"user_id": 1, "formula_id": 2}, ...]'),
+        'module_id': fields.Integer(description='Назначить все формулы модуля (вместе с user_ids)'),
+        'user_ids': fields.List(fields.Integer, description='Пользователи для назначения формул модуля')
+    }))
+    @module_ns.response(200, 'Assignment finished', bulk_assign_result_model)
+    @module_ns.response(404, 'Module not found')
+    def post(self):
+        """Назначить пользователям много формул одним запросом."""
+        data = request.json or {}
+        if not isinstance(data, dict):
+            log_error("Invalid bulk formula assignment payload: expected a JSON object")
+            return {"message": "Expected 'pairs' of {user_id, formula_id} or 'module_id' with 'user_ids'"}, 400
+        module_id = None
+        try:
+            if 'module_id' in data:
+                module_id = int(data['module_id'])
+                user_ids = [int(user_id) for user_id in data.get('user_ids') or []]
+            else:
+                pairs = parse_pairs(data.get('pairs'), 'formula_id')
+        except (TypeError, ValueError, KeyError) as e:
+            log_error(f"Invalid bulk formula assignment payload: {str(e)}")
+            return {"message": "Expected 'pairs' of {user_id, formula_id} or 'module_id' with 'user_ids'"}, 400
+        if module_id is not None:
+            if db.session.get(Modul, module_id) is None:
+                log_error(f"Module with id {module_id} not found for bulk formula assignment")
+                return {"message": f"Module with id {module_id} does not exist"}, 404
+            formula_ids = [formula_id for (formula_id,) in db.session.query(Formula.id).filter_by(idmodul=module_id)]
+            pairs = [(user_id, formula_id) for user_id in user_ids for formula_id in formula_ids]
+        if len(pairs) > BULK_ASSIGN_MAX_PAIRS:
+            return {"message": f"At most {BULK_ASSIGN_MAX_PAIRS} assignments per request"}, 400
+
+        try:
+            result = assign_bulk(UsersFormulas, UsersFormulas.idformula, Formula, pairs, 'formula_id')
+            counts = Counter(user_id for user_id, _ in result.pop('inserted_pairs'))
+            if counts:
+                count_assigned_formulas(counts)
+                bump_profile_versions(list(counts))
+            db.session.commit()
+            log_info(f"Bulk formula assignment: {result['inserted']} inserted, {result['skipped']} skipped, "
+                     f"{len(result['invalid'])} invalid")
+            return result, 200
+        except Exception as e:
+            db.session.rollback()
+            log_error(f"Failed bulk formula assignment: {str(e)}")
+            return {"message": "Database error"}, 500
+
+# Массовое назначение модулей: список пар или один модуль для списка пользователей
+@module_ns.route('/api/assign_modules_to_users', methods=['POST'])
+class AssignModulesBulk(Resource):
+    @module_ns.doc('assign_modules_to_users')
+    @module_ns.expect(module_ns.model('AssignModulesBulkPayload', {
+        'pairs': fields.List(fields.Raw, description='[{"user_id": 1, "module_id": 2}, ...]'),
+        'module_id': fields.Integer(description='Назначить модуль всем пользователям из user_ids'),
+        'user_ids': fields.List(fields.Integer, description='Пользователи для назначения модуля')
+    }))
+    @module_ns.response(200, 'Assignment finished', bulk_assign_result_model)
+    def post(self):
+        """Назначить пользователям много модулей одним запросом."""
+        data = request.json or {}
+        if not isinstance(data, dict):
+            log_error("Invalid bulk module assignment payload: expected a JSON object")
+            return {"message": "Expected 'pairs' of {user_id, module_id} or 'module_id' with 'user_ids'"}, 400
+        try:
+            if 'module_id' in data:
+                pairs = [(int(user_id), int(data['module_id'])) for user_id in data.get('user_ids') or []]
+            else:
+                pairs = parse_pairs(data.get('pairs'), 'module_id')
+        except (TypeError, ValueError, KeyError) as e:
+            log_error(f"Invalid bulk module assignment payload: {str(e)}")
+            return {"message": "Expected 'pairs' of {user_id, module_id} or 'module_id' with 'user_ids'"}, 400
+        if len(pairs) > BULK_ASSIGN_MAX_PAIRS:
+            return {"message": f"At most {BULK_ASSIGN_MAX_PAIRS} assignments per request"}, 400
+
+        try:
+            result = assign_bulk(UsersModuls, UsersModuls.idmodul, Modul, pairs, 'module_id')
+            result.pop('inserted_pairs')
+            db.session.commit()
+            log_info(f"Bulk module assignment: {result['inserted']} inserted, {result['skipped']} skipped, "
+                     f"{len(result['invalid'])} invalid")
+            return result, 200
+        except Exception as e:
+            db.session.rollback()
+            log_error(f"Failed bulk module assignment: {str(e)}")
+            return {"message": "Database error"}, 500
+
+def parse_pairs(items, target_field):
+    if not isinstance(items, list):
+        raise ValueError("'pairs' must be a list")
+    return [(int(item['user_id']), int(item[target_field])) for item in items]
+
+def assign_bulk(link_model, target_column, target_model, pairs, target_field):
+    """Вставляет пары (user_id, target_id) через INSERT ... ON CONFLICT DO NOTHING без коммита.
+
+    Пары с несуществующими пользователями или объектами не вставляются и возвращаются в 'invalid'.
+    """
+    requested = len(pairs)
+    pairs = list(dict.fromkeys(pairs))
+    user_ids = {user_id for user_id, _ in pairs}
+    target_ids = {target_id for _, target_id in pairs}
+    known_users = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))} if pairs else set()
+    known_targets = {target_id for (target_id,) in
+                     db.session.query(target_model.id).filter(target_model.id.in_(target_ids))} if pairs else set()
+
+    valid = [(user_id, target_id) for user_id, target_id in pairs if user_id in known_users and target_id in known_targets]
+    invalid = [{"user_id": user_id, target_field: target_id} for user_id, target_id in pairs
+               if user_id not in known_users or target_id not in known_targets]
+
+    inserted_pairs = []
+    for start in range(0, len(valid), BULK_INSERT_CHUNK):
+        rows = [{"iduser": user_id, target_column.key: target_id} for user_id, target_id in valid[start:start + BULK_INSERT_CHUNK]]
+        stmt = dialect_insert(link_model).values(rows).on_conflict_do_nothing() \
+            .returning(link_model.iduser, target_column)
+        inserted_pairs.extend(tuple(row) for row in db.session.execute(stmt))
+
+    return {
+        "inserted": len(inserted_pairs),
+        "skipped": requested - len(invalid) - len(inserted_pairs),
+        "invalid": invalid,
+        "inserted_pairs": inserted_pairs
+    }
+
 def list_modules():
     try:
         modules = Modul.query.all()
@@ -110,6 +277,19 @@ def list_modules():
         log_error(f"Error in list_modules: {str(e)}")
         raise
 
+def build_catalog(version, since_version=None):
+    """Каталог версии version из БД: все модули одним запросом и формулы нужных модулей вторым."""
+    modules = Modul.query.order_by(Modul.id).all()
+    changed = [module for module in modules if since_version is None or module.version > since_version]
+    formulas_by_module = {}
+    if changed:
+        formulas = Formula.query
+        if since_version is not None:
+            formulas = formulas.filter(Formula.idmodul.in_([module.id for module in changed]))
+        for formula in formulas.order_by(Formula.idmodul, Formula.id):
+            formulas_by_module.setdefault(formula.idmodul, []).append(formula.to_dict())
+    return catalog_document(version, changed, formulas_by_module, [module.id for module in modules])
+
 def list_formulas(module_id):
     try:
         module = Modul.query.get_or_404(module_id)
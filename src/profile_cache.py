@@ -0,0 +1,39 @@
+from datetime import date
+from flask import request
+from config import Config
+from models import db, User
+from cache_utils import LRUCache, json_etag
+
+# Кэш ответов /user/profile. Ключ включает users.profile_version, который увеличивается
+# в той же транзакции, что и любое изменение данных профиля, поэтому кэш согласован между воркерами.
+_cache = LRUCache(Config.PROFILE_CACHE_MAX_ENTRIES)
+
+
+def bump_profile_version(user_id):
+    db.session.query(User).filter_by(id=user_id).update({User.profile_version: User.profile_version + 1})
+
+
+def bump_profile_versions(user_ids):
+    db.session.query(User).filter(User.id.in_(user_ids)).update(
+        {User.profile_version: User.profile_version + 1}, synchronize_session=False
+    )
+
+
+# Дата входит в ключ: текущий стрик в статистике зависит от сегодняшнего дня
+def _cache_key(user_id, version):
+    return user_id, version, date.today(), tuple(sorted(request.args.items(multi=True)))
+
+
+def get_cached_profile(user_id, version):
+    """Возвращает (etag, данные) из кэша или None."""
+    return _cache.get(_cache_key(user_id, version))
+
+
+def store_profile(user_id, version, data):
+    etag = json_etag(data)
+    _cache.set(_cache_key(user_id, version), (etag, data))
+    return etag
+
+
+def cache_stats():
+    return _cache.stats()
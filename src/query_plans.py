@@ -0,0 +1,79 @@
+import click
+from datetime import datetime
+from flask.cli import with_appcontext
+from models import db, Test, Topic, Achievement, Formula, UsersFormulas, UserStats, Video, VideoHashtag
+from logger import log_info, log_warning
+
+
+def hot_queries(user_id=1, module_id=1):
+    """Запросы, выполняемые на каждый запрос к API, в том виде, в каком их строит код приложения."""
+    history = Test.query.filter(Test.user_id == user_id)
+    cursor_time = datetime(2024, 1, 1)
+    return [
+        ('user.tests_page', Test.query.filter_by(user_id=user_id).filter(db.or_(
+            Test.end_time < cursor_time,
+            db.and_(Test.end_time == cursor_time, Test.id < 100)
+        )).order_by(Test.end_time.desc(), Test.id.desc()).limit(21)),
+        ('user.topics', Topic.query.filter_by(user_id=user_id)),
+        ('user.achievements', Achievement.query.filter_by(user_id=user_id)),
+        ('achievements.earned', db.session.query(Achievement.achievement_name).filter_by(user_id=user_id)),
+        ('quiz.topic_upsert_lookup', Topic.query.filter_by(user_id=user_id, name='Кинематика')),
+        ('module.list_formulas', Formula.query.filter_by(idmodul=module_id)),
+        ('user_stats.get', db.session.query(UserStats).filter_by(user_id=user_id)),
+        ('user_stats.totals', history.with_entities(
+            db.func.count(Test.id), db.func.sum(Test.success_rate), db.func.max(Test.success_rate), db.func.max(Test.id))),
+        ('user_stats.per_section', history.with_entities(
+            Test.section, db.func.count(Test.id), db.func.sum(Test.success_rate), db.func.max(Test.success_rate)
+        ).group_by(Test.section)),
+        ('user_stats.perfected', history.with_entities(Test.section).filter(Test.success_rate == 100).distinct()),
+        ('user_stats.days', history.with_entities(Test.date, db.func.count(Test.id)).group_by(Test.date).order_by(Test.date)),
+        ('user_stats.formulas_mastered', UsersFormulas.query.filter_by(iduser=user_id)),
+        ('video.page', Video.query.filter(Video.id > 100).order_by(Video.id).limit(21)),
+        ('video.hashtag_page', Video.query.filter(Video.id > 100, Video.id.in_(
+            db.session.query(VideoHashtag.video_id).filter(VideoHashtag.hashtag.in_(['механика', 'кинематика']),
+                                                           VideoHashtag.video_id > 100)
+        )).order_by(Video.id).limit(21)),
+    ]
+
+
+def explain(query):
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+def check_query_plans():
+    """Возвращает {имя запроса: (план, найденные полные сканы)} для всех частых запросов."""
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError("EXPLAIN QUERY PLAN check is only supported for SQLite")
+
+    results = {}
+    for name, query in hot_queries():
+        plan = explain(query)
+        # "SCAN <table>" без поиска по индексу означает чтение всей таблицы (или всего индекса)
+        scans = [step for step in plan if step.startswith('SCAN ')]
+        results[name] = (plan, scans)
+        if scans:
+            log_warning(f"Full scan in hot query '{name}': {'; '.join(scans)}")
+    log_info(f"Checked query plans for {len(results)} hot queries")
+    return results
+
+
+@click.command('check-query-plans')
+@with_appcontext
+@click.option('--verbose', is_flag=True, help='Выводить полный план каждого запроса.')
+def check_query_plans_command(verbose):
+    """Проверяет через EXPLAIN QUERY PLAN, что частые запросы не читают таблицы целиком."""
+    try:
+        results = check_query_plans()
+    except Exception as e:
+        raise click.ClickException(str(e))
+
+    failed = 0
+    for name, (plan, scans) in results.items():
+        click.echo(f"{'SCAN' if scans else 'ok':<5} {name}")
+        if scans or verbose:
+            for step in plan:
+                click.echo(f"      {step}")
+        failed += bool(scans)
+    if failed:
+        raise click.ClickException(f"{failed} hot queries use full table scans")
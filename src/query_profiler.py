@@ -0,0 +1,65 @@
+import time
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import Config
+from logger import log_warning
+
+# Профилировщик запросов для разработки (QUERY_PROFILER_ENABLED): предупреждает о повторяющихся
+# в одном HTTP-запросе SQL-запросах (N+1) и пишет в лог медленные запросы с параметрами.
+_listeners_installed = False
+
+
+def init_query_profiler(app):
+    global _listeners_installed
+    if not Config.QUERY_PROFILER_ENABLED:
+        return
+    app.teardown_request(_report_repeated_statements)
+    if not _listeners_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listeners_installed = True
+    log_warning("Query profiler enabled: repeat threshold %s, slow query threshold %s ms",
+                Config.QUERY_PROFILER_REPEAT_THRESHOLD, Config.SLOW_QUERY_THRESHOLD_MS)
+
+
+def _current_route():
+    if not has_request_context():
+        return '-'
+    rule = request.url_rule.rule if request.url_rule else request.path
+    return f'{request.method} {rule}'
+
+
+# Как и в metrics, время начала хранится в контексте выполнения, а не в стеке соединения:
+# для упавшего запроса after_cursor_execute не вызывается
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.profiler_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'profiler_query_start', None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if has_request_context():
+        if 'profiler_statements' not in g:
+            g.profiler_statements = Counter()
+        g.profiler_statements[statement] += 1
+
+    if elapsed_ms >= Config.SLOW_QUERY_THRESHOLD_MS:
+        log_warning("Slow query (%.1f ms) in %s: %s; parameters: %r",
+                    elapsed_ms, _current_route(), statement, parameters)
+
+
+def _report_repeated_statements(exc):
+    statements = g.pop('profiler_statements', None)
+    if not statements:
+        return
+    for statement, count in statements.most_common():
+        if count <= Config.QUERY_PROFILER_REPEAT_THRESHOLD:
+            break
+        log_warning("Possible N+1 in %s: statement executed %s times in one request: %s",
+                    _current_route(), count, ' '.join(statement.split()))
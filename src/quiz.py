@@ -1,34 +1,46 @@
 from flask import Blueprint, jsonify, request, session
 import random
-from models import db, Formula, Test, Topic, Modul, Achievement
+from models import db, dialect_insert, Formula, Test, Topic, Modul
 from flask_restx import Resource, fields, Namespace
-from jwt_utils import IsAuthorized
+from sqlalchemy.exc import IntegrityError
+from jwt_utils import IsAuthorized, create_quiz_token, verify_quiz_token
+from config import Config
 from datetime import datetime
-from logger import log_info, log_error, log_debug
+from logger import log_info, log_sampled, log_error, log_debug
+from formula_index import sample_distractors
+from achievement_queue import enqueue_test_submitted
+from achievements import test_submitted_event, check_achievements
+from user_stats import record_test
+from profile_cache import bump_profile_version
 
 quiz_ns = Namespace('quiz', description='Operations related to quizzes')
 
 # Модели данных для документации
 check_answers_model = quiz_ns.model('CheckAnswers', {
-    'answers': fields.List(fields.String, required=True, description='Массив ответов пользователя')
+    'answers': fields.List(fields.String, required=True, description='Массив ответов пользователя'),
+    'quiz_token': fields.String(description='Подписанный токен квиза (режим stateless)')
 })
 
 symbol_quiz_model = quiz_ns.model('SymbolQuizAnswers', {
-    'answers': fields.List(fields.List(fields.String), required=True, description='Массив ответов пользователя (массив символов для каждой формулы)')
+    'answers': fields.List(fields.List(fields.String), required=True, description='Массив ответов пользователя (массив символов для каждой формулы)'),
+    'quiz_token': fields.String(description='Подписанный токен квиза (режим stateless)')
 })
 
+SYMBOL_QUIZ_EXTRA_SYMBOLS = ['+', '-', '=', '(', ')', '*', '/', '^', 'x', 'y', 'z']
+
 # Маршрут для старта обычного квиза
 @quiz_ns.route('/start/<int:module_id>')
 class StartQuiz(Resource):
-    @quiz_ns.doc(tags=['Quiz'], description="Старт квиза для указанного модуля с отправкой всех вопросов.")
+    @quiz_ns.doc(tags=['Quiz'], description="Старт квиза для указанного модуля с отправкой всех вопросов.",
+                 params={'stateless': 'Вернуть подписанный quiz_token вместо сохранения квиза в сессии'})
     def get(self, module_id):
         auth_result = IsAuthorized()
         if "error" in auth_result:
             log_error(f"Quiz start failed for module {module_id}: {auth_result['error']}")
             return {"message": auth_result["error"]}, auth_result["status"]
         
-        log_info(f"Starting quiz for module {module_id} by user {auth_result['user_id']}")
-        return start_quiz(module_id)
+        log_sampled("Starting quiz for module %s by user %s", module_id, auth_result['user_id'])
+        return start_quiz(module_id, auth_result['user_id'])
 
 # Маршрут для проверки ответов обычного квиза
 @quiz_ns.route('/submit_answers')
@@ -42,21 +54,22 @@ class SubmitAnswers(Resource):
             return {"message": auth_result["error"]}, auth_result["status"]
         
         user_id = auth_result['user_id']
-        log_info(f"User {user_id} submitting answers for quiz")
+        log_sampled("User %s submitting answers for quiz", user_id)
         return submit_answers(user_id)
 
 # Маршрут для старта квиза с символами
 @quiz_ns.route('/start_symbol_quiz/<int:module_id>')
 class StartSymbolQuiz(Resource):
-    @quiz_ns.doc(tags=['Quiz'], description="Старт квиза с разбиением формул на символы для указанного модуля.")
+    @quiz_ns.doc(tags=['Quiz'], description="Старт квиза с разбиением формул на символы для указанного модуля.",
+                 params={'stateless': 'Вернуть подписанный quiz_token вместо сохранения квиза в сессии'})
     def get(self, module_id):
         auth_result = IsAuthorized()
         if "error" in auth_result:
             log_error(f"Symbol quiz start failed for module {module_id}: {auth_result['error']}")
             return {"message": auth_result["error"]}, auth_result["status"]
         
-        log_info(f"Starting symbol quiz for module {module_id} by user {auth_result['user_id']}")
-        return start_symbol_quiz(module_id)
+        log_sampled("Starting symbol quiz for module %s by user %s", module_id, auth_result['user_id'])
+        return start_symbol_quiz(module_id, auth_result['user_id'])
 
 # Маршрут для проверки ответов квиза с символами
 @quiz_ns.route('/submit_symbol_answers')
@@ -70,11 +83,132 @@ class SubmitSymbolAnswers(Resource):
             return {"message": auth_result["error"]}, auth_result["status"]
         
         user_id = auth_result['user_id']
-        log_info(f"User {user_id} submitting answers for symbol quiz")
+        log_sampled("User %s submitting answers for symbol quiz", user_id)
         return submit_symbol_answers(user_id)
 
+def _stateless_requested():
+    value = request.args.get('stateless')
+    if value is None:
+        return Config.QUIZ_STATELESS
+    return value.lower() in ('1', 'true', 'yes')
+
+def _build_questions(formulas, rng):
+    questions = []
+    for formula in formulas:
+        correct_name = formula.name
+        wrong_names = sample_distractors(formula.id, 3, rng)
+        options = wrong_names + [correct_name]
+        rng.shuffle(options)
+
+        questions.append({
+            "id": formula.id,
+            "question": formula.formula,
+            "options": options,
+            "correct_name": correct_name
+        })
+    return questions
+
+def _build_symbol_questions(formulas, rng):
+    questions = []
+    for formula in formulas:
+        formula_cleaned = formula.formula.replace(" ", "")
+        symbols = list(formula_cleaned)
+        distractors = rng.sample([sym for sym in SYMBOL_QUIZ_EXTRA_SYMBOLS if sym not in symbols], min(5, len(symbols)))
+
+        all_symbols = symbols + distractors
+        rng.shuffle(all_symbols)
+
+        questions.append({
+            "id": formula.id,
+            "name": formula.name,
+            "correct_formula": formula_cleaned,
+            "symbols": all_symbols,
+            "length": len(symbols)
+        })
+    return questions
+
+# Восстановление квиза из подписанного токена: правильные ответы берутся из БД по id формул
+def _quiz_from_token(token, kind, user_id):
+    payload = verify_quiz_token(token, kind, user_id)
+    if "error" in payload:
+        return None, ({"message": payload["error"]}, payload["status"])
+
+    formula_ids = payload["f"]
+    formulas = {formula.id: formula for formula in Formula.query.filter(Formula.id.in_(formula_ids)).all()}
+    if len(formulas) != len(set(formula_ids)):
+        log_error(f"Quiz token for user {user_id} references formulas that no longer exist")
+        return None, ({"message": "Quiz is no longer valid."}, 409)
+
+    questions = []
+    for formula_id in formula_ids:
+        formula = formulas[formula_id]
+        if kind == 'quiz':
+            questions.append({
+                "id": formula.id,
+                "question": formula.formula,
+                "correct_name": formula.name
+            })
+        else:
+            questions.append({
+                "id": formula.id,
+                "name": formula.name,
+                "correct_formula": formula.formula.replace(" ", "")
+            })
+
+    return {
+        'module_id': payload["m"],
+        'questions': questions,
+        'start_time': datetime.fromtimestamp(payload["t"]).isoformat(),
+        'token_id': payload["j"]
+    }, None
+
+# Сохранение результата: тест, тема и новые достижения записываются одной транзакцией
+# quiz_token_id уникален: повторная отправка того же токена квиза падает с IntegrityError
+def save_quiz_result(user_id, section_name, accuracy, start_time, end_time, quiz_token_id=None):
+    new_test = Test(
+        user_id=user_id,
+        start_time=start_time,
+        end_time=end_time,
+        date=datetime.now().date(),
+        success_rate=int(accuracy),
+        section=section_name,
+        quiz_token_id=quiz_token_id
+    )
+    db.session.add(new_test)
+
+    db.session.flush()
+    record_test(new_test)
+
+    # Атомарное обновление темы: сумма и количество хранятся точно, среднее пересчитывается в БД
+    topic_insert = dialect_insert(Topic).values(
+        user_id=user_id,
+        name=section_name,
+        tests_passed=1,
+        success_sum=accuracy,
+        success_rate=accuracy
+    )
+    topic = db.session.execute(
+        topic_insert.on_conflict_do_update(
+            index_elements=[Topic.user_id, Topic.name],
+            set_={
+                'tests_passed': Topic.tests_passed + 1,
+                'success_sum': Topic.success_sum + accuracy,
+                'success_rate': (Topic.success_sum + accuracy) / (Topic.tests_passed + 1)
+            }
+        ).returning(Topic.tests_passed, Topic.success_rate)
+    ).one()
+
+    event = test_submitted_event(new_test, topic)
+    bump_profile_version(user_id)
+    if Config.ACHIEVEMENT_QUEUE_ENABLED:
+        db.session.commit()
+        enqueue_test_submitted(event)
+    else:
+        check_achievements(event)
+        db.session.commit()
+
 # Функция для старта обычного квиза
-def start_quiz(module_id):
+def start_quiz(module_id, user_id):
     try:
         module = Modul.query.get(module_id)
         if not module:
@@ -86,30 +220,24 @@ def start_quiz(module_id):
             log_error(f"Not enough formulas ({len(formulas)}) in module {module_id} for quiz")
             return {"message": "Not enough formulas in the module."}, 400
 
-        selected_formulas = random.sample(formulas, 6)
-        questions = []
-        for formula in selected_formulas:
-            correct_name = formula.name
-            all_formulas = Formula.query.filter(Formula.id != formula.id).all()
-            wrong_names = random.sample([f.name for f in all_formulas], 3)
-            options = wrong_names + [correct_name]
-            random.shuffle(options)
+        rng = random.Random()
+        selected_formulas = rng.sample(formulas, 6)
+        questions = _build_questions(selected_formulas, rng)
+        start_time = datetime.now()
+
+        if _stateless_requested():
+            token = create_quiz_token('quiz', user_id, module_id, [q["id"] for q in questions], start_time)
+            log_sampled("Stateless quiz started for module %s with %s questions", module_id, len(questions))
+            return {"questions": questions, "quiz_token": token}, 200
 
-            questions.append({
-                "id": formula.id,
-                "question": formula.formula,
-                "options": options,
-                "correct_name": correct_name
-            })
-        
         session['quiz'] = {
             'module_id': module_id,
             'questions': questions,
             'correct_answers': 0,
             'incorrect_answers': 0,
-            'start_time': datetime.now().isoformat()
+            'start_time': start_time.isoformat()
         }
-        log_info(f"Quiz started for module {module_id} with {len(questions)} questions")
+        log_sampled("Quiz started for module %s with %s questions", module_id, len(questions))
         return {"questions": questions}, 200
     except Exception as e:
         log_error(f"Error starting quiz for module {module_id}: {str(e)}")
@@ -121,7 +249,12 @@ def submit_answers(user_id):
         data = request.json
         user_answers = data.get('answers', [])
         
-        quiz = session.get('quiz', {})
+        if data.get('quiz_token'):
+            quiz, error = _quiz_from_token(data['quiz_token'], 'quiz', user_id)
+            if error:
+                return error
+        else:
+            quiz = session.get('quiz', {})
         if not quiz:
             log_error(f"User {user_id} attempted to submit answers but quiz not started")
             return {"message": "Quiz not started."}, 400
@@ -159,32 +292,7 @@ def submit_answers(user_id):
             return {"message": "Module not found"}, 404
         section_name = module.name
 
-        new_test = Test(
-            user_id=user_id,
-            start_time=start_time,
-            end_time=end_time,
-            date=datetime.now().date(),
-            success_rate=int(accuracy),
-            section=section_name
-        )
-        db.session.add(new_test)
-
-        topic = Topic.query.filter_by(user_id=user_id, name=section_name).first()
-        if topic:
-            topic.tests_passed += 1
-            topic.success_rate = ((topic.success_rate * (topic.tests_passed - 1)) + accuracy) / topic.tests_passed
-        else:
-            topic = Topic(
-                user_id=user_id,
-                name=section_name,
-                tests_passed=1,
-                success_rate=accuracy
-            )
-            db.session.add(topic)
-        
-        db.session.commit()
-        from achievements import check_achievements
-        check_achievements(user_id)
+        save_quiz_result(user_id, section_name, accuracy, start_time, end_time, quiz.get('token_id'))
         log_info(f"Quiz submitted for user {user_id}: {correct_answers}/{total_questions} correct, accuracy {accuracy}%")
         
         session.pop('quiz', None)
@@ -195,13 +303,17 @@ def submit_answers(user_id):
             "accuracy": accuracy,
             "results": results
         }, 200
+    except IntegrityError:
+        db.session.rollback()
+        log_error(f"User {user_id} resubmitted an already submitted quiz token")
+        return {"message": "Quiz already submitted."}, 409
     except Exception as e:
         db.session.rollback()
         log_error(f"Error submitting quiz answers for user {user_id}: {str(e)}")
         return {"message": f"Database error: {str(e)}"}, 500
 
 # Функция для старта квиза с символами
-def start_symbol_quiz(module_id):
+def start_symbol_quiz(module_id, user_id):
     try:
         module = Modul.query.get(module_id)
         if not module:
@@ -213,34 +325,24 @@ def start_symbol_quiz(module_id):
             log_error(f"Not enough formulas ({len(formulas)}) in module {module_id} for symbol quiz")
             return {"message": "Not enough formulas in the module."}, 400
 
-        selected_formulas = random.sample(formulas, 6)
-        questions = []
-        
-        for formula in selected_formulas:
-            formula_cleaned = formula.formula.replace(" ", "")
-            symbols = list(formula_cleaned)
-            extra_symbols = ['+', '-', '=', '(', ')', '*', '/', '^', 'x', 'y', 'z']
-            distractors = random.sample([sym for sym in extra_symbols if sym not in symbols], min(5, len(symbols)))
-            
-            all_symbols = symbols + distractors
-            random.shuffle(all_symbols)
-            
-            questions.append({
-                "id": formula.id,
-                "name": formula.name,
-                "correct_formula": formula_cleaned,
-                "symbols": all_symbols,
-                "length": len(symbols)
-            })
-        
+        rng = random.Random()
+        selected_formulas = rng.sample(formulas, 6)
+        questions = _build_symbol_questions(selected_formulas, rng)
+        start_time = datetime.now()
+
+        if _stateless_requested():
+            token = create_quiz_token('symbol_quiz', user_id, module_id, [q["id"] for q in questions], start_time)
+            log_sampled("Stateless symbol quiz started for module %s with %s questions", module_id, len(questions))
+            return {"questions": questions, "quiz_token": token}, 200
+
         session['symbol_quiz'] = {
             'module_id': module_id,
             'questions': questions,
             'correct_answers': 0,
             'incorrect_answers': 0,
-            'start_time': datetime.now().isoformat()
+            'start_time': start_time.isoformat()
         }
-        log_info(f"Symbol quiz started for module {module_id} with {len(questions)} questions")
+        log_sampled("Symbol quiz started for module %s with %s questions", module_id, len(questions))
         return {"questions": questions}, 200
     except Exception as e:
         log_error(f"Error starting symbol quiz for module {module_id}: {str(e)}")
@@ -252,7 +354,12 @@ def submit_symbol_answers(user_id):
         data = request.json
         user_answers = data.get('answers', [])
         
-        quiz = session.get('symbol_quiz', {})
+        if data.get('quiz_token'):
+            quiz, error = _quiz_from_token(data['quiz_token'], 'symbol_quiz', user_id)
+            if error:
+                return error
+        else:
+            quiz = session.get('symbol_quiz', {})
         if not quiz:
             log_error(f"User {user_id} attempted to submit symbol quiz answers but quiz not started. "
                       f"Session data: {session.items()}")
@@ -294,33 +401,7 @@ def submit_symbol_answers(user_id):
             return {"message": "Module not found"}, 404
         section_name = module.name
 
-        new_test = Test(
-            user_id=user_id,
-            start_time=start_time,
-            end_time=end_time,
-            date=datetime.now().date(),
-            success_rate=int(accuracy),
-            section=section_name + " (Symbol Quiz)"
-        )
-        db.session.add(new_test)
-
-        topic_name = section_name + " (Symbol Quiz)"
-        topic = Topic.query.filter_by(user_id=user_id, name=topic_name).first()
-        if topic:
-            topic.tests_passed += 1
-            topic.success_rate = ((topic.success_rate * (topic.tests_passed - 1)) + accuracy) / topic.tests_passed
-        else:
-            topic = Topic(
-                user_id=user_id,
-                name=topic_name,
-                tests_passed=1,
-                success_rate=accuracy
-            )
-            db.session.add(topic)
-        
-        db.session.commit()
-        from achievements import check_achievements
-        check_achievements(user_id)
+        save_quiz_result(user_id, section_name + " (Symbol Quiz)", accuracy, start_time, end_time, quiz.get('token_id'))
         log_info(f"Symbol quiz submitted for user {user_id}: {correct_answers}/{total_questions} correct, accuracy {accuracy}%")
         
         session.pop('symbol_quiz', None)
@@ -331,6 +412,10 @@ def submit_symbol_answers(user_id):
             "accuracy": accuracy,
             "results": results
         }, 200
+    except IntegrityError:
+        db.session.rollback()
+        log_error(f"User {user_id} resubmitted an already submitted symbol quiz token")
+        return {"message": "Symbol quiz already submitted."}, 409
     except Exception as e:
         db.session.rollback()
         log_error(f"Error submitting symbol quiz answers for user {user_id}: {str(e)}")
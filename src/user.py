@@ -3,10 +3,18 @@ from models import db, User, Test, Topic, Achievement
 from flask_restx import Api, Namespace, Resource, fields
 import service
 from jwt_utils import create_token, IsAuthorized
-from logger import log_info, log_error, log_debug  # Импорт функций из logger.py
+from user_stats import get_user_stats
+from pagination import encode_cursor, decode_cursor, page_limit, flag_arg
+from profile_cache import bump_profile_version, get_cached_profile, store_profile
+from cache_utils import not_modified
+from datetime import datetime
+from logger import log_info, log_sampled, log_error, log_debug  # Импорт функций из logger.py
 
 user_ns = Namespace('user', description="User operations")
 
+# Клиент может хранить профиль, но обязан перепроверять его через If-None-Match
+PROFILE_CACHE_CONTROL = 'private, no-cache'
+
 register_model = user_ns.model('Register', {
     'login': fields.String(required=True, description='User login'),
     'password': fields.String(required=True, description='User password'),
@@ -40,7 +48,10 @@ class Login(Resource):
 
 @user_ns.route('/profile')
 class Profile(Resource):
-    @user_ns.doc(description="Get user profile information.")
+    @user_ns.doc(description="Get user profile information. Tests are returned newest first, one page at a time.",
+                 params={'limit': 'Number of tests per page (default 20, max 100)',
+                         'cursor': 'Cursor from tests_next_cursor of the previous page',
+                         'all_tests': 'Return the full list of tests instead of one page'})
     def get(self):
         auth_result = IsAuthorized()
         if "error" in auth_result:
@@ -48,16 +59,32 @@ class Profile(Resource):
             return {"message": auth_result["error"]}, auth_result["status"]
         
         user_id = auth_result['user_id']
-        log_info(f"Fetching profile for user {user_id}")
+        log_sampled("Fetching profile for user %s", user_id)
         try:
             user = User.query.get(user_id)
             if not user:
                 log_error(f"User {user_id} not found for profile request")
                 return {"message": "User not found"}, 404
 
-            tests = Test.query.filter_by(user_id=user_id).all()
+            version = user.profile_version
+            cached = get_cached_profile(user_id, version)
+            if cached:
+                etag, profile_data = cached
+                if not_modified(etag):
+                    return '', 304, {'ETag': etag, 'Cache-Control': PROFILE_CACHE_CONTROL}
+                return profile_data, 200, {'ETag': etag, 'Cache-Control': PROFILE_CACHE_CONTROL}
+
+            if flag_arg('all_tests'):
+                tests, next_cursor = Test.query.filter_by(user_id=user_id).all(), None
+            else:
+                try:
+                    tests, next_cursor = tests_page(user_id, request.args.get('cursor'), page_limit())
+                except ValueError as e:
+                    log_error(f"Invalid tests cursor in profile request for user {user_id}")
+                    return {"message": str(e)}, 400
             topics = Topic.query.filter_by(user_id=user_id).all()
             achievements = Achievement.query.filter_by(user_id=user_id).all()
+            stats = get_user_stats(user_id)
 
             profile_data = {
                 "user": {
@@ -66,15 +93,65 @@ class Profile(Resource):
                     "avatar": user.avatar
                 },
                 "tests": [test.to_dict_with_time() for test in tests],
+                "tests_next_cursor": next_cursor,
+                "stats": stats.to_dict(),
                 "topics": [topic.to_dict() for topic in topics],
                 "achievements": [achievements.to_dict() for achievements in achievements]
             }
-            log_info(f"Profile retrieved successfully for user {user_id}")
-            return profile_data, 200
+            # Сохраняет строку user_stats, если get_user_stats построил её по истории
+            db.session.commit()
+            etag = store_profile(user_id, version, profile_data)
+            log_sampled("Profile retrieved successfully for user %s", user_id)
+            if not_modified(etag):
+                return '', 304, {'ETag': etag, 'Cache-Control': PROFILE_CACHE_CONTROL}
+            return profile_data, 200, {'ETag': etag, 'Cache-Control': PROFILE_CACHE_CONTROL}
         except Exception as e:
             log_error(f"Error retrieving profile for user {user_id}: {str(e)}")
             return {"message": "Internal server error"}, 500
 
+@user_ns.route('/tests')
+class TestHistory(Resource):
+    @user_ns.doc(description="Get one page of the user's tests, newest first.",
+                 params={'limit': 'Number of tests per page (default 20, max 100)',
+                         'cursor': 'Cursor from next_cursor of the previous page'})
+    def get(self):
+        auth_result = IsAuthorized()
+        if "error" in auth_result:
+            log_error(f"Test history access failed: {auth_result['error']}")
+            return {"message": auth_result["error"]}, auth_result["status"]
+
+        user_id = auth_result['user_id']
+        try:
+            tests, next_cursor = tests_page(user_id, request.args.get('cursor'), page_limit())
+            return {"tests": [test.to_dict_with_time() for test in tests], "next_cursor": next_cursor}, 200
+        except ValueError as e:
+            log_error(f"Invalid tests cursor for user {user_id}")
+            return {"message": str(e)}, 400
+        except Exception as e:
+            log_error(f"Error retrieving tests for user {user_id}: {str(e)}")
+            return {"message": "Internal server error"}, 500
+
+# Keyset-пагинация тестов по (end_time, id) от новых к старым
+def tests_page(user_id, cursor, limit):
+    query = Test.query.filter_by(user_id=user_id)
+    if cursor:
+        try:
+            end_time, test_id = decode_cursor(cursor)
+            end_time = datetime.fromisoformat(end_time)
+            test_id = int(test_id)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+        query = query.filter(db.or_(
+            Test.end_time < end_time,
+            db.and_(Test.end_time == end_time, Test.id < test_id)
+        ))
+
+    tests = query.order_by(Test.end_time.desc(), Test.id.desc()).limit(limit + 1).all()
+    if len(tests) <= limit:
+        return tests, None
+    last = tests[limit - 1]
+    return tests[:limit], encode_cursor(last.end_time.isoformat(), last.id)
+
 @user_ns.route('/validjwt')
 class ValidJWT(Resource):
     @user_ns.doc(description="Check if JWT token from Authorization header is valid.")
@@ -165,6 +242,7 @@ class Download(Resource):
                 return {"message": "User not found"}, 404
             
             user.avatar = path
+            bump_profile_version(user_id)
             db.session.commit()
             log_info(f"Avatar downloaded successfully for user {user_id}, path: {path}")
             return {"message": "Avatar downloaded successfully"}, 200
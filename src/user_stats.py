@@ -0,0 +1,158 @@
+import json
+import click
+from flask.cli import with_appcontext
+from datetime import timedelta
+from models import db, dialect_insert, User, Test, UsersFormulas, UserStats
+from profile_cache import bump_profile_version
+from logger import log_info, log_error, log_debug
+
+# Сводная статистика пользователя (таблица user_stats) обновляется инкрементально при записи,
+# чтение статистики — один запрос по первичному ключу.
+
+
+def get_user_stats(user_id):
+    """Статистика пользователя. Отсутствующая строка строится по истории и сохраняется в текущей транзакции."""
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        stats = build_user_stats(user_id)
+        insert_user_stats(stats)
+    return stats
+
+
+# Параллельные первые записи для одного пользователя не конфликтуют по первичному ключу:
+# строку вставляет первая, остальные ничего не делают
+def insert_user_stats(stats):
+    values = {column.name: getattr(stats, column.name) for column in UserStats.__table__.columns}
+    db.session.execute(dialect_insert(UserStats).values(values).on_conflict_do_nothing(index_elements=[UserStats.user_id]))
+
+
+def record_test(test):
+    """Учитывает новый тест в статистике пользователя. Вызывается в транзакции сохранения теста."""
+    query = db.session.query(UserStats).filter_by(user_id=test.user_id).with_for_update()
+    stats = query.first()
+    if stats is None:
+        insert_user_stats(build_user_stats(test.user_id, before_test_id=test.id))
+        stats = query.first()
+    if test.id <= stats.last_test_id:
+        log_debug("Test %s already counted in stats of user %s, skipping", test.id, test.user_id)
+        return stats
+    apply_test(stats, test)
+    return stats
+
+
+def apply_test(stats, test):
+    stats.total_tests += 1
+    stats.success_sum += test.success_rate
+    stats.best_success_rate = max(stats.best_success_rate, test.success_rate)
+
+    per_section = json.loads(stats.tests_per_section)
+    section = per_section.setdefault(test.section, {"tests": 0, "success_sum": 0, "best_success_rate": 0})
+    section["tests"] += 1
+    section["success_sum"] += test.success_rate
+    section["best_success_rate"] = max(section["best_success_rate"], test.success_rate)
+    stats.tests_per_section = json.dumps(per_section, ensure_ascii=False)
+
+    if test.success_rate == 100:
+        perfected = json.loads(stats.sections_perfected)
+        if test.section not in perfected:
+            stats.sections_perfected = json.dumps(perfected + [test.section], ensure_ascii=False)
+
+    if stats.last_active_date == test.date:
+        stats.tests_on_last_day += 1
+    elif stats.last_active_date is None or test.date > stats.last_active_date:
+        if stats.last_active_date == test.date - timedelta(days=1):
+            stats.current_streak += 1
+        else:
+            stats.current_streak = 1
+        stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+        stats.last_active_date = test.date
+        stats.tests_on_last_day = 1
+
+    stats.last_test_id = test.id
+
+
+def build_user_stats(user_id, before_test_id=None):
+    """Вычисляет статистику пользователя по истории тестов (без учёта тестов с id >= before_test_id)."""
+    history = Test.query.filter(Test.user_id == user_id)
+    if before_test_id is not None:
+        history = history.filter(Test.id < before_test_id)
+
+    total_tests, success_sum, best_success_rate, last_test_id = history.with_entities(
+        db.func.count(Test.id), db.func.sum(Test.success_rate), db.func.max(Test.success_rate), db.func.max(Test.id)
+    ).one()
+    per_section = {
+        section: {"tests": count, "success_sum": success, "best_success_rate": best}
+        for section, count, success, best in history.with_entities(
+            Test.section, db.func.count(Test.id), db.func.sum(Test.success_rate), db.func.max(Test.success_rate)
+        ).group_by(Test.section)
+    }
+    perfected = [section for (section,) in history.with_entities(Test.section).filter(Test.success_rate == 100).distinct()]
+    days = history.with_entities(Test.date, db.func.count(Test.id)).group_by(Test.date).order_by(Test.date).all()
+
+    current_streak = longest_streak = 0
+    previous_day = None
+    for day, _ in days:
+        current_streak = current_streak + 1 if previous_day == day - timedelta(days=1) else 1
+        longest_streak = max(longest_streak, current_streak)
+        previous_day = day
+
+    return UserStats(
+        user_id=user_id,
+        last_test_id=last_test_id or 0,
+        total_tests=total_tests,
+        tests_per_section=json.dumps(per_section, ensure_ascii=False),
+        best_success_rate=best_success_rate or 0,
+        success_sum=success_sum or 0,
+        last_active_date=days[-1][0] if days else None,
+        tests_on_last_day=days[-1][1] if days else 0,
+        current_streak=current_streak,
+        longest_streak=longest_streak,
+        sections_perfected=json.dumps(perfected, ensure_ascii=False),
+        formulas_mastered=UsersFormulas.query.filter_by(iduser=user_id).count()
+    )
+
+
+# Вызывается в той же транзакции, что и назначение формулы пользователю
+def count_assigned_formula(user_id, count=1):
+    db.session.query(UserStats).filter_by(user_id=user_id).update(
+        {UserStats.formulas_mastered: UserStats.formulas_mastered + count}
+    )
+
+
+def count_assigned_formulas(counts):
+    """Массовый вариант count_assigned_formula: counts — {user_id: число новых формул}.
+
+    Пользователи с одинаковым приростом обновляются одним UPDATE.
+    """
+    users_by_count = {}
+    for user_id, count in counts.items():
+        users_by_count.setdefault(count, []).append(user_id)
+    for count, user_ids in users_by_count.items():
+        db.session.query(UserStats).filter(UserStats.user_id.in_(user_ids)).update(
+            {UserStats.formulas_mastered: UserStats.formulas_mastered + count}, synchronize_session=False
+        )
+
+
+def rebuild_user_stats(user_id=None):
+    user_ids = [user_id] if user_id else [uid for (uid,) in db.session.query(User.id)]
+    for uid in user_ids:
+        stats = build_user_stats(uid)
+        db.session.merge(stats)
+        bump_profile_version(uid)
+    db.session.commit()
+    log_info(f"Rebuilt statistics for {len(user_ids)} users")
+    return len(user_ids)
+
+
+@click.command('rebuild-user-stats')
+@with_appcontext
+@click.option('--user-id', type=int, default=None, help='Пересчитать статистику только для одного пользователя.')
+def rebuild_user_stats_command(user_id):
+    """Пересчитывает таблицу user_stats по истории тестов."""
+    try:
+        count = rebuild_user_stats(user_id)
+        click.echo(f"Rebuilt statistics for {count} users")
+    except Exception as e:
+        db.session.rollback()
+        log_error(f"Failed to rebuild user statistics: {str(e)}")
+        raise click.ClickException(str(e))
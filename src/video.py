@@ -1,7 +1,10 @@
 from flask import request
 from flask_restx import Namespace, Resource, fields
-from models import db, Video
-from logger import log_info, log_error, log_debug
+from models import db, Video, VideoHashtag, split_hashtags
+from catalog_snapshot import bump_catalog_version, rebuild_catalog_snapshot
+from catalog_cache import catalog_response
+from pagination import encode_cursor, decode_cursor, page_limit
+from logger import log_info, log_sampled, log_error, log_debug
 
 video_ns = Namespace('video', description='Добавление видео')
 
@@ -9,9 +12,13 @@ video_model = video_ns.model('Video', {
     'link': fields.String(required=True, description='Ссылка на видео'),
     'title': fields.String(required=True, description='Название видео'),
     'description': fields.String(description='Описание видео'),
-    'hashtag': fields.String(description='Хэштег видео')
+    'hashtag': fields.String(description='Хэштеги видео, например "#механика #кинематика"')
 })
 
+VIDEO_MATCH_MODES = ('any', 'all')
+# Прежний ответ (весь список массивом) остаётся по умолчанию; страница — только с этими параметрами
+VIDEO_PAGE_ARGS = ('limit', 'cursor', 'hashtag', 'match')
+
 @video_ns.route('/add_video')
 class AddVideo(Resource):
     @video_ns.expect(video_model)
@@ -31,7 +38,9 @@ class AddVideo(Resource):
         try:
             new_video = Video(link=link, title=title, description=description, hashtag=hashtag)
             db.session.add(new_video)
+            bump_catalog_version()
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Video '{title}' added successfully")
             return new_video.to_dict(), 201
         except Exception as e:
@@ -41,16 +50,60 @@ class AddVideo(Resource):
 
 @video_ns.route('/videos')
 class VideoList(Resource):
-    @video_ns.doc('list_videos')
+    @video_ns.doc('list_videos',
+                  description="Without parameters returns the full list of videos as a plain array. "
+                              "With any of limit, cursor, hashtag or match returns one page: {videos, next_cursor}.",
+                  params={'limit': 'Number of videos per page (default 20, max 100)',
+                          'cursor': 'Cursor from next_cursor of the previous page',
+                          'hashtag': 'Hashtag filter; repeat the parameter or separate with commas for several',
+                          'match': 'any (default) - videos with any of the hashtags, all - with every hashtag'})
     def get(self):
         try:
-            videos = Video.query.all()
-            log_info(f"Retrieved {len(videos)} videos successfully")
-            return [video.to_dict() for video in videos], 200
+            if not any(name in request.args for name in VIDEO_PAGE_ARGS):
+                response = catalog_response('videos', lambda version: [video.to_dict() for video in Video.query.order_by(Video.id)])
+            else:
+                tags = split_hashtags(','.join(request.args.getlist('hashtag')))
+                match = request.args.get('match', 'any')
+                if match not in VIDEO_MATCH_MODES:
+                    return {'message': f"match must be one of: {', '.join(VIDEO_MATCH_MODES)}"}, 400
+                limit = page_limit()
+                try:
+                    after_id = decode_video_cursor(request.args.get('cursor'))
+                except ValueError as e:
+                    log_error("Invalid videos cursor")
+                    return {'message': str(e)}, 400
+                key = f"videos/page?after={after_id}&limit={limit}&match={match}&hashtag={','.join(sorted(tags))}"
+                response = catalog_response(key, lambda version: videos_page(after_id, limit, tags, match))
+            log_sampled("Retrieved videos successfully (status %s)", response.status_code)
+            return response
         except Exception as e:
             log_error(f"Error retrieving videos: {str(e)}")
             return {'message': 'Internal server error'}, 500
 
+def decode_video_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        (video_id,) = decode_cursor(cursor)
+        return int(video_id)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+# Keyset-пагинация видео по id; с хэштегами — видео с любым (any) или со всеми (all) из них
+def videos_page(after_id, limit, tags, match):
+    query = Video.query.filter(Video.id > after_id)
+    if tags:
+        video_ids = db.session.query(VideoHashtag.video_id).filter(
+            VideoHashtag.hashtag.in_(tags), VideoHashtag.video_id > after_id
+        )
+        if match == 'all':
+            video_ids = video_ids.group_by(VideoHashtag.video_id).having(db.func.count() == len(tags))
+        query = query.filter(Video.id.in_(video_ids))
+
+    videos = query.order_by(Video.id).limit(limit + 1).all()
+    next_cursor = encode_cursor(videos[limit - 1].id) if len(videos) > limit else None
+    return {'videos': [video.to_dict() for video in videos[:limit]], 'next_cursor': next_cursor}
+
 @video_ns.route('/videos/<int:video_id>')
 class VideoResource(Resource):
     @video_ns.doc('delete_video', responses={200: 'Video deleted successfully', 404: 'Video not found', 500: 'Database error'})
@@ -61,7 +114,9 @@ class VideoResource(Resource):
                 log_error(f"Video with id {video_id} not found")
                 return {'message': 'Video not found'}, 404
             db.session.delete(video)
+            bump_catalog_version()
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Video with id {video_id} deleted successfully")
             return {'message': 'Video deleted successfully'}, 200
         except Exception as e:
@@ -84,7 +139,9 @@ class VideoResource(Resource):
             video.description = data.get('description', video.description)
             video.hashtag = data.get('hashtag', video.hashtag)
 
+            bump_catalog_version()
             db.session.commit()
+            rebuild_catalog_snapshot()
             log_info(f"Video with id {video_id} updated successfully")
             return video.to_dict(), 200
         except Exception as e:
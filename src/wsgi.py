@@ -0,0 +1,20 @@
+"""Точка входа для production WSGI-сервера.
+
+Приложение можно загружать в мастер-процессе до форка воркеров (например, gunicorn --preload wsgi:application).
+Схема БД при этом не создаётся и не мигрирует — это делает `flask --app app init-db` перед запуском сервера.
+Прежняя точка входа app:application тоже работает, но без проверки версии схемы и построения снимка каталога до форка.
+"""
+from app import application
+from models import db
+from migration import current_version, LATEST_VERSION
+from catalog_snapshot import ensure_catalog_snapshot
+from logger import log_info, log_error
+
+with application.app_context():
+    version = current_version(db.engine)
+    if version != LATEST_VERSION:
+        log_error(f"Database schema version is {version}, expected {LATEST_VERSION}; run 'flask --app app init-db'")
+    else:
+        log_info(f"Database schema version {version} is up to date")
+        # Снимок каталога строится один раз до форка и отображается в память всеми воркерами
+        ensure_catalog_snapshot()